@@ -20,17 +20,50 @@ OR, to run this indefinitely even after exiting the terminal:
 nohup /home/ec2-user/gene_explorer_api/venv/bin/python app.py --weights_file "final_model.h5" --mapping_json "combined_processed_207_gene2idx.json" --initial_gene "klf3" --timepoint "2dpf" --dev_stage "larval-5dpf" --anatomy "hematopoietic_system" --port 5000 > app.log 2>&1 &
 
 
+For production, add --workers N to pre-fork N worker processes that share the
+loaded mapping, context table and weights, each with its own bounded TF thread
+pool (see --intra_op_threads, --inter_op_threads, --max_requests):
+
+python app.py --weights_file "final_model.h5" --mapping_json "combined_processed_207_gene2idx.json" --port 5000 --workers 4
+
+
 """
 
 import os
+import sys
 import json
+import time
+import heapq
+import bisect
+import signal
+import shutil
+import socket
+import hashlib
+import hmac
+import gzip
 import argparse
 import warnings
+import threading
+import multiprocessing
+import traceback
 import numpy as np
-import tensorflow as tf
+from array import array
 from flask_cors import CORS
-from collections import defaultdict
-from flask import Flask, request, jsonify
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict, deque
+from flask import Flask, request, jsonify, stream_with_context, g
+from werkzeug.serving import make_server
+
+# Optional accelerators: a faster JSON encoder and brotli compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 warnings.filterwarnings('ignore')
 
@@ -38,6 +71,9 @@ warnings.filterwarnings('ignore')
 # Constants and global definitions
 # -------------------------------------------------------------------
 SEQ_LEN = 250  # Each input chunk has 250 tokens.
+DEFAULT_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)  # Padded batch sizes with a compiled graph.
+PRECISIONS = ("float32", "bfloat16", "float16", "int8")  # Same as tsgpt_model.PRECISIONS.
+ENGINES = ("tensorflow", "numpy")
 
 TIMEPOINT_OPTIONS = ["2dpf", "3dpf", "5dpf", "10dpf", "24hpf"]
 DEVELOPMENTAL_STAGE_OPTIONS = [
@@ -54,155 +90,778 @@ app = Flask(__name__)
 CORS(app)
 
 MODEL = None
+RUNNER = None
+SCHEDULER = None
+CONTEXTS = None
+RESPONSE_CACHE = None
+EXPANSION_CACHE = None
+NEIGHBOUR_INDEX = None
+ADMISSION = None
+METRICS = None
 GENE2IDX = {}
 INDEX2GENE = {}
+GENE_LABELS = None  # Object array of gene labels indexed by token ID, built at startup.
 CONFIG = {}
+READY = False  # Set once the model is loaded and warm; reported by /health.
+WORKER = None  # The PreforkWorker serving this process, when pre-forked.
+RELOAD_STATUS = {"state": "idle", "generation": 0}  # Progress of the latest hot reload.
+RELOAD_LOCK = threading.Lock()  # Held while a reload builds its replacement model.
+SWAP_LOCK = threading.Lock()  # Held while a reload swaps the serving model state.
+MODELS = {}  # HostedModel by name for every --model variant served next to the main model.
+MODEL_ARGS = {}  # Settings (argparse.Namespace) of every --model variant, by name.
+MODEL_STATS = {}  # ModelStats by model name, kept across reloads.
 
 # -------------------------------------------------------------------
-# Model architecture
+# Inference scheduling
 # -------------------------------------------------------------------
-class TransformerBlockWithAttention(tf.keras.layers.Layer):
-    def __init__(self, embed_dim, num_heads, ff_dim, dropout=0.1):
-        super().__init__()
-        self.att = tf.keras.layers.MultiHeadAttention(num_heads=num_heads, key_dim=embed_dim)
-        self.ffn = tf.keras.Sequential([
-            tf.keras.layers.Dense(ff_dim, activation="relu"),
-            tf.keras.layers.Dense(embed_dim),
-        ])
-        self.norm1 = tf.keras.layers.LayerNormalization(epsilon=1e-6)
-        self.norm2 = tf.keras.layers.LayerNormalization(epsilon=1e-6)
-        self.dropout1 = tf.keras.layers.Dropout(dropout)
-        self.dropout2 = tf.keras.layers.Dropout(dropout)
-    
-    def call(self, x, training=False, return_attention=False):
-        if return_attention:
-            attn_out, attn_weights = self.att(x, x, x, return_attention_scores=True)
-        else:
-            attn_out = self.att(x, x, x)
-        attn_out = self.dropout1(attn_out, training=training)
-        out1 = self.norm1(x + attn_out)
-        ffn_out = self.ffn(out1)
-        ffn_out = self.dropout2(ffn_out, training=training)
-        out2 = self.norm2(out1 + ffn_out)
-        if return_attention:
-            return out2, attn_weights
-        return out2
-
-class tsGPTv207WithAttention(tf.keras.Model):
-    def __init__(
-        self,
-        vocab_size,
-        embed_dim=256,
-        num_heads=8,
-        ff_dim=768,
-        num_blocks=4,
-        dropout=0.1,
-        metadata_dim=64,
-        timepoint_classes=5,
-        stage_classes=10,
-        anatomy_classes=10,
-    ):
-        super().__init__()
-        self.vocab_size = vocab_size
-        self.embed_dim = embed_dim
-        self.metadata_dim = metadata_dim
-
-        self.gene_emb = tf.keras.layers.Embedding(vocab_size, embed_dim)
-        self.expr_dense = tf.keras.layers.Dense(embed_dim)
-        self.metadata_transform = tf.keras.layers.Dense(embed_dim, activation="relu")
-
-        self.blocks = [
-            TransformerBlockWithAttention(embed_dim, num_heads, ff_dim, dropout)
-            for _ in range(num_blocks)
-        ]
-        self.final_norm = tf.keras.layers.LayerNormalization(epsilon=1e-6)
-        self.dropout = tf.keras.layers.Dropout(dropout)
-
-        # Output heads
-        self.expr_head = tf.keras.layers.Dense(1)
-        self.tp_head = tf.keras.Sequential([
-            tf.keras.layers.Dense(embed_dim, activation="relu"),
-            tf.keras.layers.Dense(timepoint_classes, activation="softmax"),
-        ])
-        self.stage_head = tf.keras.Sequential([
-            tf.keras.layers.Dense(embed_dim, activation="relu"),
-            tf.keras.layers.Dense(stage_classes, activation="softmax"),
-        ])
-        self.anat_head = tf.keras.Sequential([
-            tf.keras.layers.Dense(embed_dim, activation="relu"),
-            tf.keras.layers.Dense(anatomy_classes, activation="softmax"),
-        ])
-    
-    def call(self, inputs, training=False, return_attention=False):
-        gene_tokens = inputs["gene_tokens"]
-        masked_expr = inputs["masked_expr"]
-        meta_emb = inputs["metadata_emb"]
-
-        # Embed gene tokens and expression
-        g = self.gene_emb(gene_tokens)
-        e = self.expr_dense(tf.expand_dims(masked_expr, axis=-1))
-        x = g + e
-
-        # Embed metadata
-        m = self.metadata_transform(meta_emb)
-        m = tf.expand_dims(m, axis=1)
-        x = x + m
-        
-        attention_weights = []
-        for block in self.blocks:
-            if return_attention:
-                x, attn = block(x, training=training, return_attention=True)
-                attention_weights.append(attn)
-            else:
-                x = block(x, training=training)
-        
-        x = self.final_norm(x)
-        x = self.dropout(x, training=training)
-        
-        # Expression logits across the tokens
-        expr_logits = self.expr_head(x)
-        expr_logits = tf.squeeze(expr_logits, axis=-1)
-        
-        # Classification heads (timepoint, stage, anatomy) use the "cls" token (x[:, 0, :])
-        cls_token = x[:, 0, :]
-        tp_out = self.tp_head(cls_token)
-        stage_out = self.stage_head(cls_token)
-        anat_out = self.anat_head(cls_token)
-        
-        outputs = {
-            "expr_recon": expr_logits,
-            "timepoint_head": tp_out,
-            "stage_head": stage_out,
-            "anatomy_head": anat_out,
+class _InferenceJob:
+    __slots__ = ("inputs", "rows", "future", "enqueued")
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.rows = len(inputs["gene_tokens"])
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batching across concurrent requests.
+
+    Request threads hand their expansion inputs to center_attention, which
+    queues them and blocks. A single scheduler thread coalesces queued jobs
+    from all in-flight requests into batches of up to max_batch_size rows,
+    waiting at most max_delay seconds after the oldest job arrived for a
+    batch to fill, runs them through the InferenceRunner and hands each job
+    its slice of the result. Exposes the same center_attention interface as
+    the runner, so callers do not need to know which one they hold.
+    """
+
+    def __init__(self, runner, max_batch_size=64, max_delay=0.002):
+        self.runner = runner
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending = deque()
+        self._pending_rows = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.jobs = 0
+        self.batches = 0
+        self.rows = 0
+        self.total_wait = 0.0
+        self._thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def center_attention(self, inputs):
+        """Queue a batch of inputs and wait for its (attn_from, attn_to)."""
+        batch_size = len(inputs["gene_tokens"])
+        jobs = []
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Inference scheduler is closed.")
+            for start in range(0, batch_size, self.max_batch_size):
+                job = _InferenceJob({k: v[start:start + self.max_batch_size] for k, v in inputs.items()})
+                jobs.append(job)
+                self._pending.append(job)
+                self._pending_rows += job.rows
+            self._cond.notify()
+        results = [job.future.result() for job in jobs]
+        return (np.concatenate([r[0] for r in results], axis=1),
+                np.concatenate([r[1] for r in results], axis=1))
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if self._closed and not self._pending:
+                return None
+            deadline = self._pending[0].enqueued + self.max_delay
+            while self._pending_rows < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            jobs = []
+            rows = 0
+            while self._pending and rows + self._pending[0].rows <= self.max_batch_size:
+                job = self._pending.popleft()
+                jobs.append(job)
+                rows += job.rows
+            self._pending_rows -= rows
+            return jobs
+
+    def _loop(self):
+        while True:
+            jobs = self._next_batch()
+            if jobs is None:
+                return
+            started = time.perf_counter()
+            try:
+                inputs = {k: np.concatenate([job.inputs[k] for job in jobs]) for k in jobs[0].inputs}
+                attn_from, attn_to = self.runner.center_attention(inputs)
+            except Exception as e:
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+            offset = 0
+            for job in jobs:
+                rows = slice(offset, offset + job.rows)
+                job.future.set_result((attn_from[:, rows], attn_to[:, rows]))
+                offset += job.rows
+                self.total_wait += started - job.enqueued
+            self.jobs += len(jobs)
+            self.batches += 1
+            self.rows += offset
+
+    def close(self):
+        """Stop the scheduler thread once the queue has drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": self._pending_rows,
+                "queued_jobs": len(self._pending),
+                "jobs": self.jobs,
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_fill": self.rows / (self.batches * self.max_batch_size) if self.batches else 0.0,
+                "mean_queue_wait_ms": 1000 * self.total_wait / self.jobs if self.jobs else 0.0,
+            }
+
+# -------------------------------------------------------------------
+# Admission control
+# -------------------------------------------------------------------
+def estimate_request_cost(max_depth, top_genes, draws=1, networks=1, vocab_size=2000):
+    """
+    Upper bound on the forward-pass rows of a network request: every node
+    above max_depth expanded once (1 + t + ... + t^(max_depth - 1) for
+    top_genes t, at most vocab_size), times the draws per node and the
+    number of networks built.
+    """
+    expansions = 0
+    level = 1
+    for _ in range(max(max_depth, 0)):
+        expansions += level
+        level *= max(top_genes, 0)
+        if expansions >= vocab_size:
+            expansions = vocab_size
+            break
+    return expansions * max(draws, 1) * max(networks, 1)
+
+def estimate_panel_cost(requests, vocab_size=2000):
+    """
+    estimate_request_cost of networks expanded together (parse_network_request
+    params of an /api/analyze_batch panel). A (gene, context) node is
+    expanded once however many networks reach it, so each context costs at
+    most vocab_size expansions per draw.
+    """
+    per_context = {}
+    for params in requests:
+        context = (params["timepoint"], params["dev_stage"], params["anatomy"])
+        per_context[context] = per_context.get(context, 0) + estimate_request_cost(
+            params["max_depth"], params["top_genes"], vocab_size=vocab_size)
+    draws = requests[0]["ensemble"] if requests else 1
+    return sum(min(cost, vocab_size) for cost in per_context.values()) * draws
+
+class AdmissionController:
+    """
+    Bounds the estimated cost (forward-pass rows, see estimate_request_cost)
+    of the network requests running at once. A request that does not fit
+    waits in FIFO order, behind at most max_queue others, until it does or
+    its wait times out. A request costlier than the whole capacity counts
+    as exactly the capacity: it runs alone once it reaches the head of the
+    queue, so heavy requests still get through without pushing in_flight
+    past the capacity.
+    """
+
+    def __init__(self, capacity, max_queue=32, timeout=30.0):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self.in_flight = 0
+        self.running = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def _fits(self, cost):
+        return self.in_flight + cost <= self.capacity
+
+    def acquire(self, cost, timeout=None):
+        """Wait until a request of this cost may run. Returns False if rejected."""
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        cost = min(cost, self.capacity)
+        with self._cond:
+            if not self._queue and self._fits(cost):
+                self._admit(cost)
+                return True
+            if len(self._queue) >= self.max_queue or timeout <= 0:
+                self.rejected += 1
+                return False
+            ticket = object()
+            self._queue.append(ticket)
+            self.queued += 1
+            deadline = time.perf_counter() + timeout
+            try:
+                while not (self._queue[0] is ticket and self._fits(cost)):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+                self._admit(cost)
+                return True
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def _admit(self, cost):
+        self.in_flight += cost
+        self.running += 1
+        self.admitted += 1
+
+    def release(self, cost):
+        with self._cond:
+            self.in_flight -= min(cost, self.capacity)
+            self.running -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "running": self.running,
+                "waiting": len(self._queue),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+            }
+
+# -------------------------------------------------------------------
+# Caching
+# -------------------------------------------------------------------
+class ResponseCache:
+    """
+    Thread-safe LRU cache of encoded JSON response bodies, each stored with
+    its Content-Encoding (None when uncompressed), bounded by the total
+    number of bytes it holds rather than by entry count.
+    """
+
+    ENTRY_OVERHEAD = 256  # Rough per-entry cost of the key, tuple and dict slot.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """(body, encoding) of a cached response, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, encoding=None):
+        size = len(body) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= len(self._entries.pop(key)[0]) + self.ENTRY_OVERHEAD
+            self._entries[key] = (body, encoding)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted) + self.ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class ExpansionCache:
+    """
+    Thread-safe LRU cache of per-node expansions (the scored top_relationships
+    dict of one gene in one context), bounded by entry count. Entries are
+    shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            relationships = self._entries.get(key)
+            if relationships is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return relationships
+
+    def put(self, key, relationships):
+        with self._lock:
+            self._entries[key] = relationships
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# -------------------------------------------------------------------
+# Neighbour index
+# -------------------------------------------------------------------
+class NeighbourIndex:
+    """
+    Precomputed top-K attention neighbours of every gene in every known
+    context (deterministic sampling), as memory-mapped .npy arrays in one
+    directory:
+
+      ids.npy     [num_contexts, vocab_size, K] neighbour token IDs, best
+                  first, padded with -1 (int16 while the vocabulary fits)
+      scores.npy  [num_contexts, vocab_size, K] float16 scores
+      filled.npy  [num_contexts, vocab_size] uint8, 1 once a row is written
+
+    index.json records the weights fingerprint and build parameters. Rows
+    are stored in score order, so any top_n <= K is a prefix of a row.
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.meta = json.load(f)
+        self.top_k = self.meta["top_k"]
+        self.contexts = {tuple(c): row for row, c in enumerate(self.meta["contexts"])}
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mode)
+        self.scores = np.load(os.path.join(path, "scores.npy"), mmap_mode=mode)
+        self.filled = np.load(os.path.join(path, "filled.npy"), mmap_mode=mode)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def metadata(fingerprint, vocab_size, top_k):
+        """index.json contents for an index over the given weights."""
+        return {
+            "source": fingerprint,
+            "seq_len": SEQ_LEN,
+            "vocab_size": vocab_size,
+            "top_k": top_k,
+            "contexts": [list(context) for context in known_contexts()],
         }
-        if return_attention:
-            return outputs, attention_weights
-        return outputs
-    
-    def predict_with_attention(self, inputs):
-        return self.call(inputs, training=False, return_attention=True)
+
+    @classmethod
+    def create(cls, path, meta):
+        """Allocate an empty index at path, replacing whatever was there."""
+        tmp_dir = f"{path}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        shape = (len(meta["contexts"]), meta["vocab_size"])
+        id_dtype = np.int16 if meta["vocab_size"] <= np.iinfo(np.int16).max else np.int32
+        ids = np.lib.format.open_memmap(os.path.join(tmp_dir, "ids.npy"), mode="w+",
+                                        dtype=id_dtype, shape=shape + (meta["top_k"],))
+        ids[:] = -1
+        ids.flush()
+        np.lib.format.open_memmap(os.path.join(tmp_dir, "scores.npy"), mode="w+",
+                                  dtype=np.float16, shape=shape + (meta["top_k"],)).flush()
+        np.lib.format.open_memmap(os.path.join(tmp_dir, "filled.npy"), mode="w+",
+                                  dtype=np.uint8, shape=shape).flush()
+        with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_dir, path)
+        return cls(path, mode="r+")
+
+    def serves(self, fingerprint, vocab_size):
+        """Whether this index was built from these weights and settings."""
+        return (self.meta["source"] == fingerprint and self.meta["vocab_size"] == vocab_size
+                and self.meta["seq_len"] == SEQ_LEN
+                and self.meta["contexts"] == [list(c) for c in known_contexts()])
+
+    def get(self, gene_id, timepoint, dev_stage, anatomy, top_n):
+        """The top_n relationships dict of a gene, or None when not indexed."""
+        row = self.contexts.get((timepoint, dev_stage, anatomy))
+        found = (row is not None and top_n <= self.top_k
+                 and 0 <= gene_id < self.filled.shape[1] and self.filled[row, gene_id])
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not found:
+            return None
+        ids = self.ids[row, gene_id, :top_n]
+        scores = self.scores[row, gene_id, :top_n]
+        return {int(t): float(score) for t, score in zip(ids, scores) if t >= 0}
+
+    def write(self, row, gene_ids, relationships):
+        """Store the top-K relationships dicts of gene_ids in context row."""
+        for gene_id, rels in zip(gene_ids, relationships):
+            count = min(len(rels), self.top_k)
+            self.ids[row, gene_id, :count] = list(rels)[:count]
+            self.ids[row, gene_id, count:] = -1
+            self.scores[row, gene_id, :count] = list(rels.values())[:count]
+        # Rows are flagged only once their contents are on disk
+        self.ids.flush()
+        self.scores.flush()
+        self.filled[row, gene_ids] = 1
+        self.filled.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows_filled": int(np.count_nonzero(self.filled)),
+                "rows": int(self.filled.size),
+                "top_k": self.top_k,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+def open_neighbour_index(path, fingerprint, vocab_size):
+    """Open the index at path for serving, or return None if missing or stale."""
+    try:
+        index = NeighbourIndex(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if not index.serves(fingerprint, vocab_size):
+        print(f"Neighbour index {path} was built from other weights or settings; ignoring it "
+              f"(rebuild with --build_neighbour_index).")
+        return None
+    return index
+
+# -------------------------------------------------------------------
+# Metrics
+# -------------------------------------------------------------------
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (type, help) of every exported metric, in /metrics order
+METRIC_DEFINITIONS = {
+    "gene_explorer_requests_total": ("counter", "HTTP requests by endpoint and status."),
+    "gene_explorer_errors_total": ("counter", "Failed network requests by endpoint."),
+    "gene_explorer_request_seconds": ("histogram", "Request latency by endpoint "
+                                                   "(time to the first byte for streams)."),
+    "gene_explorer_stage_seconds": ("histogram", "Per-request time spent in each stage of a "
+                                                 "network request."),
+    "gene_explorer_forward_passes_total": ("counter", "Model calls made for network requests."),
+    "gene_explorer_forward_rows_total": ("counter", "Genes run through the model."),
+    "gene_explorer_nodes_expanded_total": ("counter", "Network nodes expanded."),
+    "gene_explorer_expansion_cache_hits_total": ("counter", "Expansions served by the "
+                                                            "expansion cache."),
+    "gene_explorer_expansion_index_hits_total": ("counter", "Expansions served by the "
+                                                            "neighbour index."),
+    "gene_explorer_rejected_total": ("counter", "Network requests turned away by admission "
+                                                "control, by reason."),
+    "gene_explorer_truncated_total": ("counter", "Networks cut short by their deadline."),
+    "gene_explorer_model_networks_total": ("counter", "Networks built, by model."),
+    "gene_explorer_model_forward_rows_total": ("counter", "Genes run through the model, by model."),
+}
+
+_NO_SPAN = nullcontext()
+
+class Histogram:
+    """Latency histogram with fixed upper bounds, rendered as cumulative buckets."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'{name}_bucket{{{_format_labels(labels + (("le", le),))}}} {cumulative}')
+        lines.append(f"{name}_sum{{{_format_labels(labels)}}} {self.sum!r}")
+        lines.append(f"{name}_count{{{_format_labels(labels)}}} {self.count}")
+        return lines
+
+def _format_labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+class RequestTimings:
+    """
+    Stage spans and forward-pass counts of one network request. With
+    stages=False (low-overhead metrics) span() is a no-op and only the
+    counts are kept.
+    """
+
+    __slots__ = ("stages", "totals", "forward_passes", "forward_rows")
+
+    def __init__(self, stages=True):
+        self.stages = stages
+        self.totals = {}
+        self.forward_passes = 0
+        self.forward_rows = 0
+
+    @contextmanager
+    def _span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[stage] = self.totals.get(stage, 0.0) + time.perf_counter() - start
+
+    def span(self, stage):
+        return self._span(stage) if self.stages else _NO_SPAN
+
+    def server_timing(self):
+        """Server-Timing header value (milliseconds per stage)."""
+        return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.totals.items())
+
+def stage_span(timings, stage):
+    """Span of a stage in an optional RequestTimings."""
+    return _NO_SPAN if timings is None else timings.span(stage)
+
+class Metrics:
+    """
+    Process-wide counters and histograms, exported in the Prometheus text
+    format by /metrics. stage_timings=False is the low-overhead mode: no
+    per-stage clocks on the hot path, only counters and request latency.
+    """
+
+    def __init__(self, stage_timings=True):
+        self.stage_timings = stage_timings
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def request_timings(self):
+        return RequestTimings(stages=self.stage_timings)
+
+    def record_network(self, network, timings):
+        """Fold a finished network request into the counters and stage histograms."""
+        self.record_networks([network], timings)
+
+    def record_networks(self, networks, timings, model=None):
+        """record_network for a request that built several networks (on the named model)."""
+        summaries = [network.summary or {} for network in networks]
+        self.inc("gene_explorer_forward_passes_total", timings.forward_passes)
+        self.inc("gene_explorer_forward_rows_total", timings.forward_rows)
+        if model is not None:
+            self.inc("gene_explorer_model_networks_total", len(networks), model=model)
+            self.inc("gene_explorer_model_forward_rows_total", timings.forward_rows, model=model)
+        for key, name in (("expansions", "gene_explorer_nodes_expanded_total"),
+                          ("expansion_cache_hits", "gene_explorer_expansion_cache_hits_total"),
+                          ("expansion_index_hits", "gene_explorer_expansion_index_hits_total")):
+            self.inc(name, sum(summary.get(key, 0) for summary in summaries))
+        self.inc("gene_explorer_truncated_total", sum(bool(summary.get("truncated")) for summary in summaries))
+        for stage, seconds in timings.totals.items():
+            self.observe("gene_explorer_stage_seconds", seconds, stage=stage)
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.counts[:], h.sum, h.count) for key, h in self._histograms.items()}
+        lines = []
+        for name, (kind, help_text) in METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        label_text = f"{{{_format_labels(labels)}}}" if labels else ""
+                        lines.append(f"{name}{label_text} {value}")
+            else:
+                for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                    if metric == name:
+                        snapshot = Histogram()
+                        snapshot.counts, snapshot.sum, snapshot.count = counts, total, count
+                        lines.extend(snapshot.render(name, labels))
+        return "\n".join(lines) + "\n"
+
+# -------------------------------------------------------------------
+# Model hosting
+# -------------------------------------------------------------------
+# Settings a --model variant may override; everything else (the gene
+# mapping, context table, thread pools, admission control) is shared
+MODEL_OPTIONS = (
+    "vocab_size", "embedding_dim", "num_heads", "ff_dim", "num_blocks", "dropout",
+    "timepoint_classes", "stage_classes", "anatomy_classes",
+    "engine", "precision", "batch_buckets", "jit_compile", "eager", "warmup",
+    "weights_cache_dir", "no_weights_cache", "neighbour_index", "no_neighbour_index",
+)
+# MODEL_OPTIONS that take a comma-separated list, written with "+" in a --model spec
+MODEL_LIST_OPTIONS = ("batch_buckets",)
+
+class ModelStats:
+    """
+    Per-model request counters reported by /health. Forward passes and rows
+    are only counted while metrics are on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "networks": 0, "nodes_expanded": 0, "truncated": 0,
+                       "forward_passes": 0, "forward_rows": 0}
+
+    def record(self, networks, timings=None):
+        summaries = [network.summary or {} for network in networks]
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts["networks"] += len(networks)
+            self.counts["nodes_expanded"] += sum(summary.get("expansions", 0) for summary in summaries)
+            self.counts["truncated"] += sum(bool(summary.get("truncated")) for summary in summaries)
+            if timings is not None:
+                self.counts["forward_passes"] += timings.forward_passes
+                self.counts["forward_rows"] += timings.forward_rows
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+class HostedModel:
+    """
+    One servable model: its settings (a CONFIG-like dict) and the runner,
+    scheduler, neighbour index and caches built for its weights. Requests
+    hold on to the HostedModel they started with, so a reload can replace
+    it without disturbing them.
+    """
+
+    def __init__(self, name, config, model, runner, scheduler=None, neighbour_index=None,
+                 response_cache=None, expansion_cache=None):
+        self.name = name
+        self.config = config
+        self.model = model
+        self.runner = runner
+        self.scheduler = scheduler
+        self.neighbour_index = neighbour_index
+        self.response_cache = response_cache
+        self.expansion_cache = expansion_cache
+
+    @property
+    def stats(self):
+        return MODEL_STATS.setdefault(self.name, ModelStats())
+
+    def describe(self):
+        """Settings and statistics of the model for /health."""
+        status = {key: self.config.get(key) for key in ("weights_file", "engine", "precision",
+                                                        "vocab_size", "num_blocks")}
+        status["stats"] = self.stats.stats()
+        for key, part in (("response_cache", self.response_cache), ("expansion_cache", self.expansion_cache),
+                          ("neighbour_index", self.neighbour_index), ("scheduler", self.scheduler)):
+            if part is not None:
+                status[key] = part.stats()
+        return status
+
+def hosted_model(name=None):
+    """
+    The HostedModel a request runs on: the --model variant called name, or
+    the main model (the --weights_file one, also reachable as
+    --model_name) when name is None. None for an unknown name.
+    """
+    if name is not None and name != CONFIG.get('model_name'):
+        return MODELS.get(name)
+    with SWAP_LOCK:
+        return HostedModel(CONFIG.get('model_name'), CONFIG, MODEL, RUNNER, SCHEDULER, NEIGHBOUR_INDEX,
+                           RESPONSE_CACHE, EXPANSION_CACHE)
+
+def record_networks(hosted, networks, timings):
+    """Count a request's finished networks in hosted's stats and, with metrics on, in METRICS."""
+    hosted.stats.record(networks, timings)
+    if timings is not None:
+        METRICS.record_networks(networks, timings, model=hosted.name)
 
 # -------------------------------------------------------------------
 # Utility / inference functions
 # -------------------------------------------------------------------
+def stable_seed(*parts):
+    """Process-independent 64-bit seed derived from the given values."""
+    key = "|".join(str(part) for part in parts).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+def known_contexts():
+    """Every (timepoint, dev_stage, anatomy) combination of the option lists, in table order."""
+    return [
+        (timepoint, dev_stage, anatomy)
+        for timepoint in TIMEPOINT_OPTIONS
+        for dev_stage in DEVELOPMENTAL_STAGE_OPTIONS
+        for anatomy in ANATOMY_OPTIONS
+    ]
+
 def create_metadata_embedding(timepoint, dev_stage, anatomy, dim=64):
-    """Create a pseudo-embedding for the context metadata, based on random seeds."""
-    seed = hash(f"{timepoint}_{dev_stage}_{anatomy}") % 10000
-    np.random.seed(seed)
-    embedding = np.random.normal(0, 0.1, dim).astype(np.float32)
+    """
+    Create a pseudo-embedding for the context metadata, based on stable seeds.
+    Each draw uses its own Generator, so this is thread-safe and identical in
+    every process.
+    """
+    rng = np.random.default_rng(stable_seed("context", timepoint, dev_stage, anatomy))
+    embedding = rng.normal(0, 0.1, dim).astype(np.float32)
     
     # Slight modifications for each portion of the context
-    timepoint_seed = hash(timepoint) % 10000
-    np.random.seed(timepoint_seed)
-    embedding[0:16] += np.random.normal(0, 0.5, 16)
+    rng = np.random.default_rng(stable_seed("timepoint", timepoint))
+    embedding[0:16] += rng.normal(0, 0.5, 16).astype(np.float32)
     
-    stage_seed = hash(dev_stage) % 10000
-    np.random.seed(stage_seed)
-    embedding[16:32] += np.random.normal(0, 0.5, 16)
+    rng = np.random.default_rng(stable_seed("dev_stage", dev_stage))
+    embedding[16:32] += rng.normal(0, 0.5, 16).astype(np.float32)
     
-    anatomy_seed = hash(anatomy) % 10000
-    np.random.seed(anatomy_seed)
-    embedding[32:48] += np.random.normal(0, 0.5, 16)
+    rng = np.random.default_rng(stable_seed("anatomy", anatomy))
+    embedding[32:48] += rng.normal(0, 0.5, 16).astype(np.float32)
     
     # Normalize
     norm = np.linalg.norm(embedding)
@@ -210,279 +869,2658 @@ def create_metadata_embedding(timepoint, dev_stage, anatomy, dim=64):
         embedding /= norm
     return embedding
 
-def create_input_data(gene_id, timepoint, dev_stage, anatomy, vocab_size=2000):
+class ContextTable:
+    """
+    Metadata embeddings for every (timepoint, dev_stage, anatomy) combination
+    of TIMEPOINT_OPTIONS x DEVELOPMENTAL_STAGE_OPTIONS x ANATOMY_OPTIONS,
+    computed once into a contiguous [num_contexts, dim] array. Requests look
+    contexts up by row index. Combinations outside the option lists are
+    computed on first use and appended, up to max_extra of them; requests
+    reserve their rows up front (see reserve_contexts), so a full table
+    turns new unknown contexts away with 400.
+    """
+
+    def __init__(self, dim=64, max_extra=1000):
+        self.dim = dim
+        self.max_extra = max_extra
+        self._lock = threading.Lock()
+        self._index = {}
+        rows = []
+        for context in known_contexts():
+            self._index[context] = len(rows)
+            rows.append(create_metadata_embedding(*context, dim))
+        self.num_known = len(rows)
+        self.embeddings = np.stack(rows)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def index(self, timepoint, dev_stage, anatomy):
+        """Row index of a context, computing unknown contexts lazily."""
+        key = (timepoint, dev_stage, anatomy)
+        idx = self._index.get(key)
+        if idx is not None:
+            return idx
+        with self._lock:
+            idx = self._index.get(key)
+            if idx is None:
+                if len(self.embeddings) - self.num_known >= self.max_extra:
+                    raise ValueError(f"Unknown context {key} and the context table is full.")
+                embedding = create_metadata_embedding(timepoint, dev_stage, anatomy, self.dim)
+                self.embeddings = np.concatenate([self.embeddings, embedding[np.newaxis, :]])
+                idx = len(self.embeddings) - 1
+                self._index[key] = idx
+        return idx
+
+def reserve_contexts(contexts):
+    """
+    Give every (timepoint, dev_stage, anatomy) context a CONTEXTS row before
+    a request starts work. Returns an error message when an unknown context
+    no longer fits in the table, else None.
+    """
+    try:
+        for context in contexts:
+            CONTEXTS.index(*context)
+    except ValueError as e:
+        return str(e)
+    return None
+
+def create_input_data(gene_id, timepoint, dev_stage, anatomy, vocab_size=2000,
+                      deterministic=False):
     """Assemble model input from a gene token, plus contextual embeddings."""
-    gene_tokens = np.random.randint(0, vocab_size, SEQ_LEN, dtype=np.int64)
+    return create_batch_input_data([gene_id], timepoint, dev_stage, anatomy, vocab_size,
+                                   deterministic=deterministic)
+
+def create_batch_input_data(gene_ids, timepoint, dev_stage, anatomy, vocab_size=2000,
+                            deterministic=False):
+    """
+    Assemble a [B, SEQ_LEN] model input with one row per gene token, all in
+    the same context (see create_context_batch_input_data).
+    """
+    return create_context_batch_input_data(gene_ids, [(timepoint, dev_stage, anatomy)] * len(gene_ids),
+                                           vocab_size, deterministic=deterministic)
+
+def create_context_batch_input_data(gene_ids, contexts, vocab_size=2000, deterministic=False,
+                                    shared_background=False, draw_ids=None):
+    """
+    Assemble a [B, SEQ_LEN] model input with one row per gene token, row i
+    in the (timepoint, dev_stage, anatomy) context contexts[i].
+
+    With deterministic=True each row's background tokens come from a private
+    np.random.Generator seeded from (gene_id, context), so the same gene in
+    the same context always sees the same input. Otherwise they are drawn
+    from the global RNG. With shared_background=True the background depends
+    on the gene alone, so rows of one gene in different contexts differ only
+    in their context. draw_ids optionally numbers independent background
+    draws of the same gene and context (draw 0 is the usual background).
+    Contexts are passed as their CONTEXTS row indices.
+    """
+    batch_size = len(gene_ids)
+    if deterministic or shared_background:
+        gene_tokens = np.empty((batch_size, SEQ_LEN), dtype=np.int64)
+        backgrounds = {}
+        for row, (gene_id, context) in enumerate(zip(gene_ids, contexts)):
+            key = (gene_id,) if shared_background else (gene_id, *context)
+            if draw_ids is not None and draw_ids[row]:
+                key += (draw_ids[row],)
+            if key not in backgrounds:
+                if deterministic:
+                    rng = np.random.default_rng(stable_seed(*key))
+                    backgrounds[key] = rng.integers(0, vocab_size, SEQ_LEN, dtype=np.int64)
+                else:
+                    backgrounds[key] = np.random.randint(0, vocab_size, SEQ_LEN, dtype=np.int64)
+            gene_tokens[row] = backgrounds[key]
+    else:
+        gene_tokens = np.random.randint(0, vocab_size, (batch_size, SEQ_LEN), dtype=np.int64)
+    rows = {context: CONTEXTS.index(*context) for context in set(contexts)}
+    context_idx = np.array([rows[context] for context in contexts], dtype=np.int64)
     center_pos = SEQ_LEN // 2
-    gene_tokens[center_pos] = gene_id  # position the "main" gene in the center
+    gene_tokens[:, center_pos] = gene_ids  # position each "main" gene in the center
     
-    masked_expr = np.zeros(SEQ_LEN, dtype=np.float32)  # no expression data
-    metadata_emb = create_metadata_embedding(timepoint, dev_stage, anatomy)
+    masked_expr = np.zeros((batch_size, SEQ_LEN), dtype=np.float32)  # no expression data
     
     inputs = {
-        "gene_tokens": tf.convert_to_tensor(gene_tokens, dtype=tf.int64)[tf.newaxis, :],
-        "masked_expr": tf.convert_to_tensor(masked_expr, dtype=tf.float32)[tf.newaxis, :],
-        "metadata_emb": tf.convert_to_tensor(metadata_emb, dtype=tf.float32)[tf.newaxis, :],
+        "gene_tokens": gene_tokens,
+        "masked_expr": masked_expr,
+        "context_idx": context_idx,
     }
     return inputs, center_pos
 
-def process_attention_for_gene_network(attention_weights, gene_tokens, center_pos, top_n=30):
+def center_attention_slices(attention_weights, center_pos):
     """
-    Extract relationships from attention maps around the central "target" gene.
-    Returns a dictionary of token_id -> attention score, for the top_n tokens.
+    Reduce full attention maps to the centre row and column, averaged over
+    heads. Returns (attn_from, attn_to) NumPy arrays of shape
+    [num_layers, batch, seq_len].
     """
-    num_layers = len(attention_weights)
-    batch_idx = 0
-    relationships = defaultdict(float)
-    
-    for layer_idx, layer_attention in enumerate(attention_weights):
+    attn_from = []
+    attn_to = []
+    for layer_attention in attention_weights:
         # shape of layer_attention: [batch, num_heads, seq_len, seq_len]
-        target_from = layer_attention[batch_idx, :, center_pos, :]
-        target_to = layer_attention[batch_idx, :, :, center_pos]
-        
-        avg_from = tf.reduce_mean(target_from, axis=0)  # average over heads
-        avg_to = tf.reduce_mean(target_to, axis=0)
-        
-        layer_weight = (layer_idx + 1) / num_layers
-        
-        for pos, score_val in enumerate(avg_from.numpy()):
-            if pos == center_pos:
-                continue
-            token_id = gene_tokens[batch_idx, pos].numpy()
-            relationships[token_id] += score_val * layer_weight
-        
-        # We weigh the "to" side slightly differently
-        for pos, score_val in enumerate(avg_to.numpy()):
-            if pos == center_pos:
-                continue
-            token_id = gene_tokens[batch_idx, pos].numpy()
-            relationships[token_id] += score_val * layer_weight * 0.8
-    
-    sorted_items = sorted(relationships.items(), key=lambda x: x[1], reverse=True)
-    return dict(sorted_items[:top_n])
+        layer_attention = np.asarray(layer_attention)
+        attn_from.append(layer_attention[:, :, center_pos, :].mean(axis=1))
+        attn_to.append(layer_attention[:, :, :, center_pos].mean(axis=1))
+    return np.stack(attn_from), np.stack(attn_to)
 
-def analyze_gene_network(model, gene_id, timepoint, dev_stage, anatomy,
-                         vocab_size, max_depth=2, top_genes_per_level=15):
+def score_center_attention(attn_from, attn_to, gene_tokens, center_pos, top_n=30):
     """
-    Build a small 'network' by repeatedly sampling the model's attention
-    around the central gene, expanding out to max_depth levels.
+    Turn head-averaged centre attention into per-token relationship scores
+    for a whole batch at once.
+
+    attn_from / attn_to are [num_layers, batch, seq_len] arrays and
+    gene_tokens is [batch, seq_len]. Layer l contributes (l + 1) / num_layers
+    of its attention, and the "to" side a further 0.8. Returns one dict of
+    token_id -> score (top_n tokens, highest first) per batch row.
     """
-    network_data = {
-        "nodes": {},
-        "edges": [],
-        "target_id": gene_id
-    }
-    queue = [(gene_id, 0)]
-    visited = set([gene_id])
-
-    # If you wish, remove tqdm or simply print progress messages instead
-    # for minimal server logs.
-    while queue:
-        current_id, current_depth = queue.pop(0)
-        if current_depth > max_depth:
-            continue
-        
-        # Insert a node if it doesn't exist
-        if current_id not in network_data["nodes"]:
-            network_data["nodes"][current_id] = {
-                "token_id": current_id,
-                "depth": current_depth,
-                "degree": 0,
-                "is_source": (current_depth == 0)
-            }
+    gene_tokens = np.asarray(gene_tokens, dtype=np.int64)
+    num_layers, batch_size, seq_len = attn_from.shape
+    keep = np.arange(seq_len) != center_pos
+    tokens = gene_tokens[:, keep]  # [batch, seq_len - 1]
 
-        # If we're at max depth, don't expand more children
-        if current_depth == max_depth:
-            continue
-        
-        # Run one forward pass with attention
-        inputs, center_pos = create_input_data(
-            gene_id=current_id,
-            timepoint=timepoint,
-            dev_stage=dev_stage,
-            anatomy=anatomy,
-            vocab_size=vocab_size
-        )
-        outputs, attentions = model.predict_with_attention(inputs)
+    # [batch, layer, side, pos] terms, laid out in the order the scalar
+    # implementation accumulated them so the float64 sums match exactly.
+    layer_weights = (np.arange(num_layers) + 1) / num_layers
+    side_weights = np.array([1.0, 0.8])
+    sides = np.stack([attn_from[:, :, keep], attn_to[:, :, keep]], axis=1)
+    terms = sides.astype(np.float64) * layer_weights[:, None, None, None] * side_weights[None, :, None, None]
+    terms = terms.transpose(2, 0, 1, 3)
 
-        # Extract top relationships
-        top_relationships = process_attention_for_gene_network(
-            attentions, inputs["gene_tokens"], center_pos, top_n=top_genes_per_level
-        )
-        
-        # Populate edges/nodes
-        for related_token_id, score in top_relationships.items():
-            if related_token_id == current_id:
-                continue
-            
-            if related_token_id not in network_data["nodes"]:
-                network_data["nodes"][related_token_id] = {
-                    "token_id": related_token_id,
-                    "depth": current_depth + 1,
-                    "degree": 0,
-                    "is_source": False
-                }
-            
-            # Check if edge already exists
-            edge_exists = any(
-                (e["source"] == current_id and e["target"] == related_token_id) or
-                (e["source"] == related_token_id and e["target"] == current_id)
-                for e in network_data["edges"]
-            )
-            if not edge_exists:
-                network_data["edges"].append({
-                    "source": current_id,
-                    "target": related_token_id,
-                    "score": float(score),
-                    "depth": current_depth + 1
-                })
-                network_data["nodes"][current_id]["degree"] += 1
-                network_data["nodes"][related_token_id]["degree"] += 1
-            
-            # Enqueue child if we have not visited it yet
-            if related_token_id not in visited and (current_depth + 1) <= max_depth:
-                queue.append((related_token_id, current_depth + 1))
-                visited.add(related_token_id)
-    
-    # Add summary info
-    network_data["summary"] = {
-        "num_nodes": len(network_data["nodes"]),
-        "num_edges": len(network_data["edges"]),
-        "max_depth": max_depth
-    }
-    return network_data
+    vocab = int(tokens.max()) + 1 if tokens.size else 1
+    offsets = (np.arange(batch_size, dtype=np.int64) * vocab)[:, None, None, None]
+    bins = np.broadcast_to(tokens[:, None, None, :] + offsets, terms.shape)
+    scores = np.bincount(bins.ravel(), weights=terms.ravel(), minlength=batch_size * vocab)
+    scores = scores.reshape(batch_size, vocab)
 
-def create_gene_label(token_id, index2gene):
-    """Convert a numeric token ID back to a gene name."""
-    key_str = str(token_id)
-    if key_str in index2gene:
-        return index2gene[key_str]
-    return f"Gene_{token_id}"
+    relationships = []
+    for row in range(batch_size):
+        # Candidate tokens with their first position, which breaks score ties
+        # the same way the old insertion-ordered dict did.
+        token_ids, first_pos = np.unique(tokens[row], return_index=True)
+        row_scores = scores[row, token_ids]
+        count = min(max(top_n, 0), len(token_ids))
+        if count == 0:
+            relationships.append({})
+            continue
+        if count < len(token_ids):
+            kth = np.partition(row_scores, len(row_scores) - count)[len(row_scores) - count]
+            candidates = np.flatnonzero(row_scores >= kth)
+        else:
+            candidates = np.arange(len(token_ids))
+        order = np.lexsort((first_pos[candidates], -row_scores[candidates]))[:count]
+        chosen = candidates[order]
+        relationships.append({
+            int(token_id): float(score)
+            for token_id, score in zip(token_ids[chosen], row_scores[chosen])
+        })
+    return relationships
 
-def prepare_network_for_visualization(network_data):
+def process_attention_for_gene_network(attention_weights, gene_tokens, center_pos, top_n=30):
     """
-    Transform the network data for visualization by adding gene labels and
-    ensuring all data types are JSON-serializable
+    Extract relationships from attention maps around the central "target" gene.
+    Returns a list with one dictionary of token_id -> attention score, for the
+    top_n tokens, per batch row.
     """
-    vis_data = {
-        "nodes": [],
-        "edges": [],
-        "summary": network_data["summary"]
-    }
-    
-    # Process nodes
-    for token_id, node_data in network_data["nodes"].items():
-        gene_label = create_gene_label(token_id, INDEX2GENE)
-        
-        # ENHANCEMENT: Improved tooltip that encourages double-clicking
-        tooltip = ""
-        
-        vis_data["nodes"].append({
-            "id": str(token_id),
-            "label": gene_label,
-            "title": tooltip,
-            "depth": node_data["depth"],
-            "degree": node_data["degree"],
-            "is_source": node_data["is_source"],
-            "token_id": int(token_id)
-        })
-    
-    # Process edges
-    for edge in network_data["edges"]:
-        source_label = create_gene_label(edge["source"], INDEX2GENE)
-        target_label = create_gene_label(edge["target"], INDEX2GENE)
-        
-        vis_data["edges"].append({
-            "from": str(edge["source"]),
-            "to": str(edge["target"]),
-            "title": f"{source_label} → {target_label}  Score: {edge['score']:.4f}",
-            "value": edge["score"] * 5,  # Scale for visualization
-            "depth": edge["depth"]
-        })
-    
-    # Add the target gene ID
-    vis_data["target_id"] = str(network_data["target_id"])
-    vis_data["target_gene"] = create_gene_label(network_data["target_id"], INDEX2GENE)
-    
-    return vis_data
-
-# -------------------------------------------------------------------
-# Flask Routes
-# -------------------------------------------------------------------
+    attn_from, attn_to = center_attention_slices(attention_weights, center_pos)
+    return score_center_attention(attn_from, attn_to, gene_tokens, center_pos, top_n=top_n)
 
-@app.route("/api/analyze", methods=["POST"])
-def analyze():
+def aggregate_draws(draw_relationships, top_n):
     """
-    Main API endpoint: receives a JSON payload specifying 'gene_name', 
-    context arguments, and the desired depth/top genes. Returns
-    a JSON object with the node/edge graph for that gene's network.
+    Combine the relationships of several background draws of one node into
+    token_id -> (mean, std, frequency): the mean and standard deviation of
+    the token's score over the draws it was a top gene in, and the fraction
+    of draws that was. Keeps the top_n tokens by expected score (mean x
+    frequency), highest first, ties going to the token seen first.
     """
-    data = request.json
-    gene_name = data.get('gene_name')
-    timepoint = data.get('timepoint', CONFIG.get('timepoint'))
-    dev_stage = data.get('dev_stage', CONFIG.get('dev_stage'))
-    anatomy = data.get('anatomy', CONFIG.get('anatomy'))
-    max_depth = int(data.get('max_depth', CONFIG.get('network_depth', 3)))
-    top_genes = int(data.get('top_genes', CONFIG.get('top_genes', 13)))
-    
-    if not gene_name or gene_name not in GENE2IDX:
-        return jsonify({"error": f"Gene '{gene_name}' not found in mapping."}), 404
-    
-    gene_id = GENE2IDX[gene_name]
-    
-    try:
-        network_data = analyze_gene_network(
-            model=MODEL,
-            gene_id=gene_id,
-            timepoint=timepoint,
-            dev_stage=dev_stage,
-            anatomy=anatomy,
-            vocab_size=CONFIG.get('vocab_size', 2000),
-            max_depth=max_depth,
-            top_genes_per_level=top_genes
-        )
-        # Convert to a more front-end-friendly structure
-        vis_data = prepare_network_for_visualization(network_data)
-        return jsonify(vis_data)
-    except Exception as e:
-        return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
+    scores = {}
+    for relationships in draw_relationships:
+        for token_id, score in relationships.items():
+            scores.setdefault(token_id, []).append(score)
+    num_draws = len(draw_relationships)
+    ranked = sorted(scores.items(), key=lambda item: -sum(item[1]))[:max(top_n, 0)]
+    return {
+        token_id: (float(np.mean(values)), float(np.std(values)), len(values) / num_draws)
+        for token_id, values in ranked
+    }
 
-@app.route("/api/get_gene_name/<token_id>")
-def get_gene_name(token_id):
+def expand_gene_nodes(runner, gene_ids, timepoint, dev_stage, anatomy,
+                      vocab_size, top_n=15, max_batch_size=None, deterministic=False,
+                      cache=None, index=None, timings=None, draws=1, deadline=None):
     """
-    Optional endpoint: given a numeric token ID, returns the corresponding gene name.
+    Run the model (through an InferenceRunner or InferenceScheduler) over a
+    list of centre genes as stacked [B, SEQ_LEN] batches of at most
+    max_batch_size rows, and return (expansions, cache_hits, index_hits):
+    the top relationships of every gene, in input order, and how many of
+    them came from the ExpansionCache or the NeighbourIndex instead of a
+    forward pass. Stage spans and forward passes are recorded in timings.
+
+    With draws > 1 every gene is run over that many background draws (rows
+    of the same batches) and its relationships map token_id -> (mean, std,
+    frequency) (see aggregate_draws). Once time.perf_counter() passes
+    deadline no further batches are run and the remaining genes' expansions
+    are None.
     """
-    try:
-        gene_name = create_gene_label(token_id, INDEX2GENE)
-        return jsonify({"gene_name": gene_name})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    context = (timepoint, dev_stage, anatomy)
+    expansions, sources = expand_gene_context_nodes(
+        runner, [(gene_id, context) for gene_id in gene_ids], vocab_size, top_n=top_n,
+        max_batch_size=max_batch_size, deterministic=deterministic, cache=cache, index=index,
+        timings=timings, draws=draws, deadline=deadline
+    )
+    return expansions, sources.count("cache"), sources.count("index")
 
-@app.route("/health", methods=["GET"])
-def health_check():
+def expand_gene_context_nodes(runner, pairs, vocab_size, top_n=15, max_batch_size=None,
+                              deterministic=False, cache=None, index=None, timings=None,
+                              shared_background=False, draws=1, deadline=None):
     """
-    Simple health check endpoint so you can confirm the server is running.
+    expand_gene_nodes over (gene_id, (timepoint, dev_stage, anatomy)) pairs:
+    rows in different contexts share batches, since only their context
+    index differs. Returns (expansions, sources), where sources[i] is
+    "index", "cache", "model", or "skipped" (expansion None) past the
+    deadline. The cache and index hold per-context backgrounds, so callers
+    pass neither with shared_background.
     """
-    return jsonify({"status": "ok", "message": "Gene Explorer API is up and running."})
+    expansions = [None] * len(pairs)
+    sources = ["model"] * len(pairs)
+    pending = []
+    if draws > 1:
+        index = None  # the index stores single-draw neighbours
+    cache_suffix = (draws,) if draws > 1 else ()
+    for idx, (gene_id, context) in enumerate(pairs):
+        if index is not None:
+            expansions[idx] = index.get(gene_id, *context, top_n)
+            if expansions[idx] is not None:
+                sources[idx] = "index"
+                continue
+        if cache is not None:
+            expansions[idx] = cache.get((gene_id, *context, top_n) + cache_suffix)
+        if expansions[idx] is None:
+            pending.append(idx)
+        else:
+            sources[idx] = "cache"
+
+    # One row per (node, draw); a node's draws may span several chunks
+    rows = [(idx, draw) for idx in pending for draw in range(draws)]
+    draw_relationships = {idx: [] for idx in pending}
+    chunk_size = max_batch_size or len(rows) or 1
+    for start in range(0, len(rows), chunk_size):
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        chunk = rows[start:start + chunk_size]
+        with stage_span(timings, "input"):
+            inputs, center_pos = create_context_batch_input_data(
+                gene_ids=[pairs[idx][0] for idx, _ in chunk],
+                contexts=[pairs[idx][1] for idx, _ in chunk],
+                vocab_size=vocab_size,
+                deterministic=deterministic,
+                shared_background=shared_background,
+                draw_ids=[draw for _, draw in chunk] if draws > 1 else None
+            )
+        with stage_span(timings, "forward"):
+            attn_from, attn_to = runner.center_attention(inputs)
+        with stage_span(timings, "scoring"):
+            scored = score_center_attention(
+                attn_from, attn_to, inputs["gene_tokens"], center_pos, top_n=top_n
+            )
+        if timings is not None:
+            timings.forward_passes += 1
+            timings.forward_rows += len(chunk)
+        for (idx, _), relationships in zip(chunk, scored):
+            draw_relationships[idx].append(relationships)
+
+    with stage_span(timings, "scoring"):
+        for idx in pending:
+            if len(draw_relationships[idx]) < draws:
+                sources[idx] = "skipped"
+                continue
+            if draws > 1:
+                expansions[idx] = aggregate_draws(draw_relationships[idx], top_n)
+            else:
+                expansions[idx] = draw_relationships[idx][0]
+            if cache is not None:
+                gene_id, context = pairs[idx]
+                cache.put((gene_id, *context, top_n) + cache_suffix, expansions[idx])
+    return expansions, sources
 
 # -------------------------------------------------------------------
-# Main / Initialization
+# Network building
 # -------------------------------------------------------------------
-def main():
-    global MODEL, GENE2IDX, INDEX2GENE, CONFIG
-    
-    parser = argparse.ArgumentParser(description="Gene Network Inference Backend")
-    parser.add_argument("--weights_file", required=True, help="H5 file with model weights.")
+class NetworkBuilder:
+    """
+    Gene network under construction, stored column-wise in typed arrays.
+
+    Nodes and edges are rows of parallel arrays. Edges are deduplicated
+    through an index keyed by the canonical (min, max) token pair, so adding
+    an edge is O(1) whatever the size of the graph. Newly discovered nodes
+    that still need expanding wait in a deque frontier. Ensemble expansions
+    also record each edge's (score_std, frequency) in edge_stats, by row,
+    and rows that add_edge replaced collect in updated_edges.
+    """
+
+    __slots__ = (
+        "target_id", "max_depth", "frontier", "summary",
+        "node_ids", "node_depths", "node_degrees", "_node_rows",
+        "edge_sources", "edge_targets", "edge_scores", "edge_depths", "_edge_rows",
+        "edge_stats", "updated_edges",
+    )
+
+    def __init__(self, target_id, max_depth):
+        self.target_id = target_id
+        self.max_depth = max_depth
+        self.frontier = deque()
+        self.summary = {}
+        self.node_ids = array("q")
+        self.node_depths = array("i")
+        self.node_degrees = array("i")
+        self._node_rows = {}
+        self.edge_sources = array("q")
+        self.edge_targets = array("q")
+        self.edge_scores = array("d")
+        self.edge_depths = array("i")
+        self._edge_rows = {}
+        self.edge_stats = {}
+        self.updated_edges = set()
+        self.add_node(target_id, 0)
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_sources)
+
+    def has_node(self, token_id):
+        return token_id in self._node_rows
+
+    def depth_of(self, token_id):
+        return self.node_depths[self._node_rows[token_id]]
+
+    def add_node(self, token_id, depth):
+        """Add a node (queuing it for expansion) unless it already exists."""
+        row = self._node_rows.get(token_id)
+        if row is None:
+            row = len(self.node_ids)
+            self._node_rows[token_id] = row
+            self.node_ids.append(token_id)
+            self.node_depths.append(depth)
+            self.node_degrees.append(0)
+            if depth < self.max_depth:
+                self.frontier.append(token_id)
+        return row
+
+    def add_edge(self, source, target, score, depth, replace=False):
+        """
+        Add an undirected edge unless one already joins the two nodes, and
+        return its row (None when nothing changed). The first edge found
+        wins, as in a node-by-node BFS. With replace, an existing edge found
+        again from a shallower node, or with a higher score from a node at
+        the same depth, takes the new source, score and depth instead, so
+        the result does not depend on expansion order (see
+        expand_network_beam).
+        """
+        key = (source, target) if source <= target else (target, source)
+        row = self._edge_rows.get(key)
+        if row is None:
+            row = len(self.edge_sources)
+            self._edge_rows[key] = row
+            self.edge_sources.append(source)
+            self.edge_targets.append(target)
+            self.edge_scores.append(score)
+            self.edge_depths.append(depth)
+            self.node_degrees[self._node_rows[source]] += 1
+            self.node_degrees[self._node_rows[target]] += 1
+            return row
+        if not replace or depth > self.edge_depths[row] or (depth == self.edge_depths[row]
+                                                            and score <= self.edge_scores[row]):
+            return None
+        self.edge_sources[row] = source
+        self.edge_targets[row] = target
+        self.edge_scores[row] = score
+        self.edge_depths[row] = depth
+        self.edge_stats.pop(row, None)
+        self.updated_edges.add(row)
+        return row
+
+    def next_level(self):
+        """Pop every frontier node that sits at the shallowest queued depth."""
+        if not self.frontier:
+            return [], None
+        depth = self.node_depths[self._node_rows[self.frontier[0]]]
+        level = []
+        while self.frontier and self.node_depths[self._node_rows[self.frontier[0]]] == depth:
+            level.append(self.frontier.popleft())
+        return level, depth
+
+    def add_relationships(self, current_id, current_depth, top_relationships, replace=False):
+        """
+        Add the edges (and any new nodes) from one node's expansion. Scores
+        are floats, or (mean, std, frequency) tuples from an ensemble.
+
+        Level-by-level expansion always reaches a node by its shortest path
+        first; best-first expansion may not. A known node reached here at a
+        shallower depth is moved up to it, and the ids of the moved nodes
+        are returned. replace is passed on to add_edge.
+        """
+        depth = current_depth + 1
+        moved = []
+        for related_token_id, score in top_relationships.items():
+            if related_token_id == current_id:
+                continue
+            row = self._node_rows.get(related_token_id)
+            if row is None:
+                self.add_node(related_token_id, depth)
+            elif depth < self.node_depths[row]:
+                self.node_depths[row] = depth
+                moved.append(related_token_id)
+            if isinstance(score, tuple):
+                score, std, frequency = score
+                row = self.add_edge(current_id, related_token_id, score, depth, replace)
+                if row is not None:
+                    self.edge_stats[row] = (std, frequency)
+            else:
+                self.add_edge(current_id, related_token_id, float(score), depth, replace)
+        return moved
+
+def expand_network(network, runner, timepoint, dev_stage, anatomy, vocab_size,
+                   top_genes_per_level=15, max_batch_size=None, deterministic=False,
+                   expansion_cache=None, neighbour_index=None, timings=None, draws=1,
+                   deadline=None, beam=None):
+    """
+    Expand a NetworkBuilder level by level, yielding the depth of each new
+    level as soon as its nodes and edges are in, and fill network.summary
+    once the frontier is exhausted. A beam dict of expand_network_beam
+    keyword arguments (min_edge_score, min_path_score, max_expanded)
+    switches to best-first expansion.
+
+    Expansion is level-synchronous: all frontier nodes at one depth go
+    through the model together (see expand_gene_nodes), then their edges are
+    added in the same order a node-by-node BFS would add them. Nodes found
+    in neighbour_index or expansion_cache are reused instead of being run
+    again. Stage spans go to the optional RequestTimings. With draws > 1
+    each node's edges are aggregated over that many background draws.
+
+    If time.perf_counter() passes deadline, the nodes expanded so far keep
+    their edges, the rest of the frontier is dropped and the summary is
+    marked truncated.
+    """
+    if beam is not None:
+        yield from expand_network_beam(
+            network, runner, timepoint, dev_stage, anatomy, vocab_size,
+            top_genes_per_level=top_genes_per_level, max_batch_size=max_batch_size,
+            deterministic=deterministic, expansion_cache=expansion_cache,
+            neighbour_index=neighbour_index, timings=timings, draws=draws, deadline=deadline,
+            **beam
+        )
+        return
+
+    num_expanded = 0
+    num_cache_hits = 0
+    num_index_hits = 0
+    truncated_reason = None
+
+    while network.frontier:
+        # One batched forward pass (or a few chunks) for the whole level
+        frontier, current_depth = network.next_level()
+        level_relationships, cache_hits, index_hits = expand_gene_nodes(
+            runner, frontier, timepoint, dev_stage, anatomy, vocab_size,
+            top_n=top_genes_per_level, max_batch_size=max_batch_size,
+            deterministic=deterministic, cache=expansion_cache, index=neighbour_index,
+            timings=timings, draws=draws, deadline=deadline
+        )
+        num_cache_hits += cache_hits
+        num_index_hits += index_hits
+
+        with stage_span(timings, "graph"):
+            for current_id, top_relationships in zip(frontier, level_relationships):
+                if top_relationships is None:
+                    truncated_reason = "deadline"
+                    continue
+                network.add_relationships(current_id, current_depth, top_relationships)
+                num_expanded += 1
+        if truncated_reason is not None:
+            network.frontier.clear()
+        yield current_depth + 1
+    
+    # Add summary info
+    network.summary = network_summary(network, num_expanded, num_cache_hits, num_index_hits, draws,
+                                      truncated_reason)
+
+def relationship_score(score):
+    """Score of a relationship: the value itself, or the mean of an ensemble tuple."""
+    return score[0] if isinstance(score, tuple) else score
+
+def expand_network_beam(network, runner, timepoint, dev_stage, anatomy, vocab_size,
+                        top_genes_per_level=15, max_batch_size=None, deterministic=False,
+                        expansion_cache=None, neighbour_index=None, timings=None, draws=1,
+                        deadline=None, min_edge_score=0.0, min_path_score=0.0, max_expanded=None):
+    """
+    Best-first variant of expand_network. Nodes wait in a priority queue
+    keyed by path score, the product of the edge scores on the best path
+    from the target, and the highest-scoring ones are expanded first, up to
+    max_batch_size per forward pass. Edges scoring below min_edge_score are
+    dropped, nodes whose path score is below min_path_score are not
+    expanded, and expansion stops after max_expanded nodes. Yields the
+    deepest depth reached after each batch. The summary adds "beam": true,
+    "pruned_edges" and "pruned_nodes" (expandable nodes left unexpanded).
+
+    Best-first order can reach a node through a deeper path before its
+    shortest one. When the shorter path turns up the node moves up to that
+    depth: if it is still unexpanded it is queued again (it may now be
+    within max_depth), if it was already expanded its recorded edges are
+    applied again from the new depth, replacing deeper ones. So with no
+    controls set the network has the same nodes, depths and edges as
+    expand_network builds; only an edge between two nodes of the same
+    depth may carry the other direction's score (the higher of the two).
+    """
+    path_scores = {network.target_id: 1.0}
+    expanded = set()
+    kept_relationships = {}  # token_id -> the expanded node's edges, to re-apply on a move
+    queue = []
+    if network.frontier:
+        queue.append((-1.0, 0, network.target_id))
+    network.frontier.clear()
+    pushes = 1
+    num_expanded = 0
+    num_cache_hits = 0
+    num_index_hits = 0
+    pruned_edges = 0
+    truncated_reason = None
+
+    while queue and (max_expanded is None or num_expanded < max_expanded):
+        limit = max_batch_size or len(queue)
+        if max_expanded is not None:
+            limit = min(limit, max_expanded - num_expanded)
+        batch = []
+        while queue and len(batch) < limit:
+            _, _, token_id = heapq.heappop(queue)
+            if token_id not in expanded:  # else a stale entry for an improved path
+                expanded.add(token_id)
+                batch.append(token_id)
+        if not batch:
+            break
+        relationships, cache_hits, index_hits = expand_gene_nodes(
+            runner, batch, timepoint, dev_stage, anatomy, vocab_size,
+            top_n=top_genes_per_level, max_batch_size=max_batch_size,
+            deterministic=deterministic, cache=expansion_cache, index=neighbour_index,
+            timings=timings, draws=draws, deadline=deadline
+        )
+        num_cache_hits += cache_hits
+        num_index_hits += index_hits
+
+        with stage_span(timings, "graph"):
+            for current_id, top_relationships in zip(batch, relationships):
+                if top_relationships is None:
+                    truncated_reason = "deadline"
+                    expanded.discard(current_id)
+                    continue
+                num_expanded += 1
+                kept = {}
+                for related_id, score in top_relationships.items():
+                    if relationship_score(score) < min_edge_score:
+                        pruned_edges += 1
+                    else:
+                        kept[related_id] = score
+                kept_relationships[current_id] = kept
+                pending = [current_id]
+                while pending:
+                    node_id = pending.pop()
+                    node_relationships = kept_relationships[node_id]
+                    moved = network.add_relationships(node_id, network.depth_of(node_id),
+                                                      node_relationships, replace=True)
+                    for related_id in moved:
+                        if related_id in kept_relationships:
+                            pending.append(related_id)
+                    for related_id, score in node_relationships.items():
+                        if related_id in expanded:
+                            continue
+                        path_score = path_scores[node_id] * relationship_score(score)
+                        improved = path_score > path_scores.get(related_id, -1.0)
+                        if improved:
+                            path_scores[related_id] = path_score
+                        if ((improved or related_id in moved)
+                                and network.depth_of(related_id) < network.max_depth
+                                and path_scores[related_id] >= min_path_score):
+                            heapq.heappush(queue, (-path_scores[related_id], pushes, related_id))
+                            pushes += 1
+            network.frontier.clear()
+        yield max(network.depth_of(token_id) for token_id in batch) + 1
+        if truncated_reason is not None:
+            break
+
+    pruned_nodes = sum(1 for token_id, depth in zip(network.node_ids, network.node_depths)
+                       if depth < network.max_depth and token_id not in expanded)
+    network.summary = network_summary(network, num_expanded, num_cache_hits, num_index_hits, draws,
+                                      truncated_reason)
+    network.summary.update(beam=True, pruned_edges=pruned_edges, pruned_nodes=pruned_nodes)
+
+def network_summary(network, expansions, cache_hits, index_hits, draws=1, truncated_reason=None):
+    summary = {
+        "num_nodes": network.num_nodes,
+        "num_edges": network.num_edges,
+        "max_depth": network.max_depth,
+        "expansions": expansions,
+        "expansion_cache_hits": cache_hits,
+        "expansion_index_hits": index_hits,
+        "truncated": truncated_reason is not None
+    }
+    if truncated_reason is not None:
+        summary["truncated_reason"] = truncated_reason
+    if draws > 1:
+        summary["ensemble_draws"] = draws
+    return summary
+
+def expand_networks(networks, contexts, runner, vocab_size, top_genes_per_level=15,
+                    max_batch_size=None, deterministic=False, expansion_cache=None,
+                    neighbour_index=None, timings=None, panel=None, shared_background=False,
+                    draws=1, deadline=None):
+    """
+    Expand several NetworkBuilders together, networks[i] in the
+    (timepoint, dev_stage, anatomy) context contexts[i], yielding the index
+    of each network as soon as it is complete (summary filled in).
+
+    Every round takes the next frontier level of each unfinished network and
+    sends the union through the model at once (see
+    expand_gene_context_nodes), so a panel of small networks fills large
+    batches. A (gene, context) node reached by several networks is expanded
+    once and shared with the others; each network's summary counts those as
+    expansion_shared_hits. Panel totals go to the optional `panel` dict.
+    shared_background and draws are passed on to expand_gene_context_nodes.
+    Past the deadline every unfinished network is completed as truncated
+    (see expand_network).
+    """
+    counts = [{"expansions": 0, "cache": 0, "index": 0, "model": 0, "shared": 0} for _ in networks]
+    shared = {}  # (gene_id, context) -> relationships, for the whole panel
+    panel = {} if panel is None else panel
+    panel.update(rounds=0, requested_expansions=0, unique_expansions=0)
+
+    active = list(range(len(networks)))
+    while active:
+        levels = []
+        pairs = []
+        slots = {}
+        for i in active:
+            frontier, depth = networks[i].next_level()
+            owned = []
+            for gene_id in frontier:
+                key = (gene_id, contexts[i])
+                if key in shared or key in slots:
+                    counts[i]["shared"] += 1
+                    owned.append(None)
+                else:
+                    slots[key] = len(pairs)
+                    pairs.append(key)
+                    owned.append(slots[key])
+            counts[i]["expansions"] += len(frontier)
+            panel["requested_expansions"] += len(frontier)
+            levels.append((i, frontier, depth, owned))
+
+        if pairs:
+            expansions, sources = expand_gene_context_nodes(
+                runner, pairs, vocab_size, top_n=top_genes_per_level,
+                max_batch_size=max_batch_size, deterministic=deterministic,
+                cache=expansion_cache, index=neighbour_index, timings=timings,
+                shared_background=shared_background, draws=draws, deadline=deadline
+            )
+            shared.update(zip(pairs, expansions))
+            panel["rounds"] += 1
+            panel["unique_expansions"] += len(pairs)
+        past_deadline = bool(pairs) and "skipped" in sources
+
+        still_active = []
+        with stage_span(timings, "graph"):
+            for i, frontier, depth, owned in levels:
+                network = networks[i]
+                truncated = False
+                for gene_id, slot in zip(frontier, owned):
+                    relationships = shared[(gene_id, contexts[i])]
+                    if relationships is None:
+                        counts[i]["expansions"] -= 1
+                        truncated = True
+                        continue
+                    if slot is not None:
+                        counts[i][sources[slot]] += 1
+                    network.add_relationships(gene_id, depth, relationships)
+                if past_deadline:
+                    truncated = truncated or bool(network.frontier)
+                    network.frontier.clear()
+                if network.frontier:
+                    still_active.append(i)
+                    continue
+                count = counts[i]
+                network.summary = network_summary(network, count["expansions"], count["cache"],
+                                                  count["index"], draws,
+                                                  "deadline" if truncated else None)
+                network.summary["expansion_shared_hits"] = count["shared"]
+        remaining = set(still_active)
+        finished = [i for i in active if i not in remaining]
+        active = still_active
+        yield from finished
+
+def analyze_gene_network(runner, gene_id, timepoint, dev_stage, anatomy,
+                         vocab_size, max_depth=2, top_genes_per_level=15,
+                         max_batch_size=None, deterministic=False, expansion_cache=None,
+                         neighbour_index=None, draws=1, beam=None):
+    """
+    Build a small 'network' by repeatedly sampling the model's attention
+    around the central gene, expanding out to max_depth levels (see
+    expand_network, and expand_network_beam for beam=dict(min_edge_score=...,
+    min_path_score=..., max_expanded=...)). Returns a NetworkBuilder.
+    """
+    network = NetworkBuilder(gene_id, max_depth)
+    for _ in expand_network(network, runner, timepoint, dev_stage, anatomy, vocab_size,
+                            top_genes_per_level=top_genes_per_level,
+                            max_batch_size=max_batch_size, deterministic=deterministic,
+                            expansion_cache=expansion_cache,
+                            neighbour_index=neighbour_index, draws=draws, beam=beam):
+        pass
+    return network
+
+def context_score_matrix(networks):
+    """
+    Neighbour x context scores of networks built for the same target gene
+    in different contexts. Returns (neighbour_ids, scores): scores[i][j] is
+    the weight of the edge between the target and neighbour_ids[i] in
+    networks[j], or None when that neighbour is not among its top genes.
+    Neighbours are ordered by mean score (missing counting as 0).
+    """
+    columns = []
+    for network in networks:
+        column = {}
+        for source, target, score in zip(network.edge_sources, network.edge_targets, network.edge_scores):
+            if source == network.target_id:
+                column[target] = score
+            elif target == network.target_id:
+                column[source] = score
+        columns.append(column)
+    neighbour_ids = sorted(set().union(*columns),
+                           key=lambda token_id: (-sum(c.get(token_id, 0.0) for c in columns), token_id))
+    scores = [[column.get(token_id) for column in columns] for token_id in neighbour_ids]
+    return neighbour_ids, scores
+
+def diff_networks(before, after, min_delta=0.0):
+    """
+    Edges gained, lost and re-weighted going from NetworkBuilder `before`
+    to `after`, keyed by the unordered token pair. Re-weighted edges are
+    those in both whose score changed by at least min_delta, largest change
+    first. Returns (gained, lost, reweighted, unchanged_count), the first
+    three as lists of (source, target, score_before, score_after).
+    """
+    def edges(network):
+        return {
+            (source, target) if source <= target else (target, source): score
+            for source, target, score in zip(network.edge_sources, network.edge_targets,
+                                             network.edge_scores)
+        }
+    old, new = edges(before), edges(after)
+    gained = sorted(((s, t, None, score) for (s, t), score in new.items() if (s, t) not in old),
+                    key=lambda edge: -edge[3])
+    lost = sorted(((s, t, score, None) for (s, t), score in old.items() if (s, t) not in new),
+                  key=lambda edge: -edge[2])
+    common = [(s, t, old[s, t], new[s, t]) for (s, t) in old if (s, t) in new]
+    reweighted = sorted((edge for edge in common if edge[3] != edge[2] and abs(edge[3] - edge[2]) >= min_delta),
+                        key=lambda edge: -abs(edge[3] - edge[2]))
+    return gained, lost, reweighted, len(common) - len(reweighted)
+
+def create_gene_label(token_id, index2gene):
+    """Convert a numeric token ID back to a gene name."""
+    key_str = str(token_id)
+    if key_str in index2gene:
+        return index2gene[key_str]
+    return f"Gene_{token_id}"
+
+def build_label_table(index2gene, size):
+    """
+    Object array of the label of every token ID below size (at least one
+    past the largest mapped ID), with create_gene_label's fallback names
+    for unmapped IDs.
+    """
+    size = max([size] + [int(k) + 1 for k in index2gene if k.isdigit()])
+    table = np.empty(size, dtype=object)
+    for token_id in range(size):
+        table[token_id] = create_gene_label(token_id, index2gene)
+    return table
+
+def gene_label(token_id):
+    """Label of a token ID, from GENE_LABELS when it covers the ID."""
+    if GENE_LABELS is not None and 0 <= token_id < len(GENE_LABELS):
+        return GENE_LABELS[token_id]
+    return create_gene_label(token_id, INDEX2GENE)
+
+def serialize_nodes(network, start=0, stop=None, labels=None):
+    """
+    Visualization dicts for node rows [start, stop) of a NetworkBuilder.
+    Resolved gene labels are recorded in `labels` for serialize_edges.
+    """
+    labels = {} if labels is None else labels
+    rows = slice(start, stop)
+    nodes = []
+    for token_id, depth, degree in zip(network.node_ids[rows], network.node_depths[rows],
+                                       network.node_degrees[rows]):
+        label = gene_label(token_id)
+        labels[token_id] = label
+        
+        # ENHANCEMENT: Improved tooltip that encourages double-clicking
+        tooltip = ""
+        
+        nodes.append({
+            "id": str(token_id),
+            "label": label,
+            "title": tooltip,
+            "depth": depth,
+            "degree": degree,
+            "is_source": depth == 0,
+            "token_id": token_id
+        })
+    return nodes
+
+def serialize_edges(network, start=0, stop=None, labels=None):
+    """Visualization dicts for edge rows [start, stop) of a NetworkBuilder."""
+    labels = {} if labels is None else labels
+    rows = slice(start, stop)
+    edges = []
+    for row, source, target, score, depth in zip(
+            range(start, network.num_edges if stop is None else stop),
+            network.edge_sources[rows], network.edge_targets[rows],
+            network.edge_scores[rows], network.edge_depths[rows]):
+        source_label = labels.get(source) or gene_label(source)
+        target_label = labels.get(target) or gene_label(target)
+        edge = {
+            "from": str(source),
+            "to": str(target),
+            "title": f"{source_label} → {target_label}  Score: {score:.4f}",
+            "value": score * 5,  # Scale for visualization
+            "depth": depth
+        }
+        stats = network.edge_stats.get(row)
+        if stats is not None:
+            std, frequency = stats
+            edge["title"] += f" ± {std:.4f} ({frequency:.0%} of draws)"
+            edge["score_std"] = std
+            edge["frequency"] = frequency
+        edges.append(edge)
+    return edges
+
+def prepare_network_for_visualization(network):
+    """
+    Transform a NetworkBuilder for visualization by adding gene labels and
+    ensuring all data types are JSON-serializable
+    """
+    labels = {}
+    vis_data = {
+        "nodes": serialize_nodes(network, labels=labels),
+        "edges": serialize_edges(network, labels=labels),
+        "summary": network.summary
+    }
+    
+    # Add the target gene ID
+    vis_data["target_id"] = str(network.target_id)
+    vis_data["target_gene"] = labels[network.target_id]
+    
+    return vis_data
+
+def prepare_network_columns(network):
+    """
+    Columnar form of a NetworkBuilder: parallel arrays instead of one dict
+    per node and edge, with numeric IDs and raw scores. Clients derive
+    tooltips and edge widths themselves.
+    """
+    node_ids = network.node_ids.tolist()
+    if GENE_LABELS is not None and (not node_ids or max(node_ids) < len(GENE_LABELS)):
+        node_labels = GENE_LABELS[node_ids].tolist() if node_ids else []
+    else:
+        node_labels = [gene_label(token_id) for token_id in node_ids]
+    columns = {
+        "format": "columnar",
+        "nodes": {
+            "id": node_ids,
+            "label": node_labels,
+            "depth": network.node_depths.tolist(),
+            "degree": network.node_degrees.tolist(),
+        },
+        "edges": {
+            "source": network.edge_sources.tolist(),
+            "target": network.edge_targets.tolist(),
+            "score": network.edge_scores.tolist(),
+            "depth": network.edge_depths.tolist(),
+        },
+        "summary": network.summary,
+        "target_id": str(network.target_id),
+        "target_gene": gene_label(network.target_id),
+    }
+    if network.edge_stats:
+        stats = [network.edge_stats.get(row, (None, None)) for row in range(network.num_edges)]
+        columns["edges"]["score_std"] = [std for std, _ in stats]
+        columns["edges"]["frequency"] = [frequency for _, frequency in stats]
+    return columns
+
+def encode_json(payload):
+    """
+    Compact JSON bytes with sorted keys. Uses orjson when it is installed;
+    otherwise the output is byte-for-byte what jsonify would send.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (app.json.dumps(payload, separators=(",", ":")) + "\n").encode("utf-8")
+
+def negotiate_encoding(accept_encoding, size):
+    """
+    Content-Encoding for a response body of `size` bytes given the request's
+    Accept-Encoding header: "br" (when brotli is installed), "gzip", or None
+    when compression is off, not accepted, or not worth it.
+    """
+    if CONFIG.get("no_compression") or size < CONFIG.get("compress_min_bytes", 1024):
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=5)
+    return body
+
+def body_response(body, encoding=None):
+    """A JSON response around already-encoded (and possibly compressed) bytes."""
+    response = app.response_class(body, mimetype=app.json.mimetype)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+# -------------------------------------------------------------------
+# Flask Routes
+# -------------------------------------------------------------------
+
+def parse_network_request(data, hosted=None):
+    """
+    Read the gene, context and depth/top-gene arguments of a network request
+    to the hosted model (default: the main model), falling back to the
+    server defaults. Returns (params, error, status); error is a message
+    and status its HTTP status when the gene is unknown to the mapping or
+    the model (404), or "ensemble", "deadline_ms" or a "beam" control is
+    invalid or the context does not fit in the context table (400).
+    """
+    hosted = hosted or hosted_model()
+    gene_name = data.get('gene_name')
+    params = {
+        "gene_name": gene_name,
+        "timepoint": data.get('timepoint', CONFIG.get('timepoint')),
+        "dev_stage": data.get('dev_stage', CONFIG.get('dev_stage')),
+        "anatomy": data.get('anatomy', CONFIG.get('anatomy')),
+        "max_depth": int(data.get('max_depth', CONFIG.get('network_depth', 3))),
+        "top_genes": int(data.get('top_genes', CONFIG.get('top_genes', 13))),
+        "deterministic": CONFIG.get('sampling') == "deterministic",
+        "columnar": data.get('format', request.args.get('format')) == "columnar",
+    }
+    try:
+        ensemble = int(data.get('ensemble', 1))
+    except (TypeError, ValueError):
+        return None, "'ensemble' must be an integer number of draws.", 400
+    params["ensemble"] = min(max(ensemble, 1), CONFIG.get('max_ensemble', 64))
+    # The server's --request_deadline, or a shorter "deadline_ms" from the client
+    seconds = CONFIG.get('request_deadline', 0)
+    if data.get('deadline_ms') is not None:
+        try:
+            requested = float(data['deadline_ms']) / 1000
+        except (TypeError, ValueError):
+            requested = 0
+        if not requested > 0:
+            return None, "'deadline_ms' must be a positive number of milliseconds.", 400
+        seconds = min(seconds, requested) if seconds > 0 else requested
+    params["beam"], error = parse_beam(data.get('beam'))
+    if error:
+        return None, error, 400
+    if not gene_name or gene_name not in GENE2IDX:
+        return None, f"Gene '{gene_name}' not found in mapping.", 404
+    params["gene_id"] = GENE2IDX[gene_name]
+    if params["gene_id"] >= hosted.config.get('vocab_size', 2000):
+        return None, f"Gene '{gene_name}' is outside the vocabulary of model '{hosted.name}'.", 404
+    error = reserve_contexts([(params["timepoint"], params["dev_stage"], params["anatomy"])])
+    if error:
+        return None, error, 400
+    params["model"] = hosted
+    params["timings"] = METRICS.request_timings() if METRICS is not None else None
+    params["cost"] = estimate_request_cost(params["max_depth"], params["top_genes"], params["ensemble"],
+                                           vocab_size=hosted.config.get('vocab_size', 2000))
+    if params["beam"] is not None and params["beam"]["max_expanded"] is not None:
+        params["cost"] = min(params["cost"], params["beam"]["max_expanded"] * params["ensemble"])
+    params["deadline"] = time.perf_counter() + seconds if seconds > 0 else None
+    return params, None, None
+
+def parse_beam(spec):
+    """
+    expand_network_beam controls from a request's "beam": true for the
+    defaults, or an object with any of min_edge_score, min_path_score and
+    max_expanded. Returns (beam, error); beam is None when beam mode is
+    off, error a message when a control is not a number.
+    """
+    if not spec:
+        return None, None
+    spec = spec if isinstance(spec, dict) else {}
+    beam = {}
+    for key in ("min_edge_score", "min_path_score"):
+        try:
+            beam[key] = float(spec.get(key, 0.0))
+        except (TypeError, ValueError):
+            return None, f"'beam.{key}' must be a number."
+    max_expanded = spec.get('max_expanded', CONFIG.get('beam_max_expanded'))
+    try:
+        max_expanded = int(max_expanded) if max_expanded else None
+    except (TypeError, ValueError):
+        max_expanded = -1
+    if max_expanded is not None and max_expanded < 0:
+        return None, "'beam.max_expanded' must be a non-negative integer."
+    beam["max_expanded"] = max_expanded
+    return beam, None
+
+def network_options(params):
+    """expand_network keyword arguments for parsed request params, on the request's model."""
+    hosted = params["model"]
+    return {
+        "runner": hosted.scheduler or hosted.runner,
+        "timepoint": params["timepoint"],
+        "dev_stage": params["dev_stage"],
+        "anatomy": params["anatomy"],
+        "vocab_size": hosted.config.get('vocab_size', 2000),
+        "top_genes_per_level": params["top_genes"],
+        "max_batch_size": CONFIG.get('max_batch_size'),
+        "deterministic": params["deterministic"],
+        "expansion_cache": hosted.expansion_cache if params["deterministic"] else None,
+        "neighbour_index": hosted.neighbour_index if params["deterministic"] else None,
+        "timings": params["timings"],
+        "draws": params["ensemble"],
+        "deadline": params["deadline"],
+        "beam": params["beam"],
+    }
+
+def admit_request(cost, deadline=None):
+    """
+    Reserve ADMISSION capacity for a request of the given estimated cost
+    (see estimate_request_cost), waiting at most until its deadline.
+    Returns None once admitted, after which the caller must call
+    release_request(cost), or the error response to send: 400 for a cost
+    above --max_request_cost, 429 when the wait for capacity fails.
+    """
+    max_cost = CONFIG.get('max_request_cost', 0)
+    if max_cost and cost > max_cost:
+        if METRICS is not None:
+            METRICS.inc("gene_explorer_rejected_total", reason="cost")
+        return jsonify({"error": f"Estimated cost of {cost} forward-pass rows exceeds the limit of "
+                                 f"{max_cost}; lower max_depth, top_genes or ensemble."}), 400
+    if ADMISSION is None:
+        return None
+    timeout = None if deadline is None else deadline - time.perf_counter()
+    if not ADMISSION.acquire(cost, timeout):
+        if METRICS is not None:
+            METRICS.inc("gene_explorer_rejected_total", reason="saturated")
+        response = jsonify({"error": "Server is saturated; retry shortly."})
+        response.status_code = 429
+        response.headers["Retry-After"] = "1"
+        return response
+    return None
+
+def release_request(cost):
+    if ADMISSION is not None:
+        ADMISSION.release(cost)
+
+def stream_release(cost):
+    """
+    release_request(cost) that only acts once, for streams: they release
+    when the generator finishes and again when the response is closed,
+    which also covers clients that disconnect before the first chunk.
+    """
+    lock = threading.Lock()
+    pending = [True]
+
+    def release():
+        with lock:
+            if not pending:
+                return
+            pending.clear()
+        release_request(cost)
+    return release
+
+@app.route("/api/analyze", methods=["POST"])
+@app.route("/api/<model>/analyze", methods=["POST"])
+def analyze(model=None):
+    """
+    Main API endpoint: receives a JSON payload specifying 'gene_name', 
+    context arguments, and the desired depth/top genes. Returns
+    a JSON object with the node/edge graph for that gene's network.
+
+    With "format": "columnar" (or ?format=columnar) the graph comes back as
+    parallel arrays (see prepare_network_columns). "ensemble": N scores
+    every node over N background draws in the same batches, and edges report
+    the mean score, its standard deviation and the fraction of draws they
+    appeared in. "beam" switches to best-first expansion (see parse_beam
+    and expand_network_beam). Bodies are gzip or brotli compressed when the
+    client's Accept-Encoding allows it. /api/<model>/analyze runs on a
+    --model variant instead of the main model.
+    """
+    hosted = hosted_model(model)
+    if hosted is None:
+        return jsonify({"error": f"Unknown model '{model}'."}), 404
+    params, error, status = parse_network_request(request.json, hosted)
+    if error:
+        return jsonify({"error": error}), status
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+
+    # Deterministic responses are a pure function of the request, so repeat
+    # queries can be answered from the model's response cache, per response
+    # format and preferred encoding. A hot reload replaces the cache; this
+    # request keeps the one it began with.
+    response_cache = hosted.response_cache
+    cache_key = None
+    if params["deterministic"] and response_cache is not None:
+        cache_key = (params["gene_name"], params["timepoint"], params["dev_stage"],
+                     params["anatomy"], params["max_depth"], params["top_genes"],
+                     params["columnar"], params["ensemble"],
+                     tuple(sorted(params["beam"].items())) if params["beam"] else None,
+                     negotiate_encoding(accept_encoding, float("inf")))
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            response = body_response(*cached)
+            response.headers["X-Cache"] = "HIT"
+            return response
+
+    rejection = admit_request(params["cost"], params["deadline"])
+    if rejection is not None:
+        return rejection
+    try:
+        timings = params["timings"]
+        network = NetworkBuilder(params["gene_id"], params["max_depth"])
+        for _ in expand_network(network, **network_options(params)):
+            pass
+        # Convert to a more front-end-friendly structure
+        with stage_span(timings, "serialize"):
+            if params["columnar"]:
+                vis_data = prepare_network_columns(network)
+            else:
+                vis_data = prepare_network_for_visualization(network)
+        with stage_span(timings, "encode"):
+            body = encode_json(vis_data)
+            encoding = negotiate_encoding(accept_encoding, len(body))
+            body = compress_body(body, encoding)
+        response = body_response(body, encoding)
+        record_networks(hosted, [network], timings)
+        if timings is not None and timings.totals:
+            response.headers["Server-Timing"] = timings.server_timing()
+        if cache_key is not None and not network.summary["truncated"]:
+            response_cache.put(cache_key, body, encoding)
+            response.headers["X-Cache"] = "MISS"
+        return response
+    except Exception as e:
+        return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
+    finally:
+        release_request(params["cost"])
+
+@app.route("/api/analyze_stream", methods=["POST"])
+@app.route("/api/<model>/analyze_stream", methods=["POST"])
+def analyze_stream(model=None):
+    """
+    Streaming variant of /api/analyze. Sends the network one BFS level at a
+    time, as soon as each level is built, using the node/edge schema of
+    /api/analyze:
+
+      {"type": "level", "depth": 1, "nodes": [...], "edges": [...],
+       "target_id": ..., "target_gene": ...}      first record (target + depth 1)
+      {"type": "level", "depth": d, "nodes": [...], "edges": [...]}
+      {"type": "summary", "summary": {...}, "degrees": {node_id: degree}}
+
+    Node degrees grow as later levels add edges, so the summary record
+    carries the final degree of every node (and, for beam requests, the
+    final depth of every node). Beam expansion can also replace an edge
+    sent earlier (see expand_network_beam); a level record then repeats
+    it, with its new source, score and depth, in "updated_edges". Records are NDJSON, or
+    Server-Sent Events when the client sends Accept: text/event-stream.
+    """
+    hosted = hosted_model(model)
+    if hosted is None:
+        return jsonify({"error": f"Unknown model '{model}'."}), 404
+    params, error, status = parse_network_request(request.json, hosted)
+    if error:
+        return jsonify({"error": error}), status
+    rejection = admit_request(params["cost"], params["deadline"])
+    if rejection is not None:
+        return rejection
+    release = stream_release(params["cost"])
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+
+    def encode(record):
+        payload = app.json.dumps(record, separators=(",", ":"))
+        if use_sse:
+            return f"event: {record['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    def generate():
+        timings = params["timings"]
+        network = NetworkBuilder(params["gene_id"], params["max_depth"])
+        labels = {}
+        nodes_sent = 0
+        edges_sent = 0
+        try:
+            levels = expand_network(network, **network_options(params))
+            for depth in levels:
+                with stage_span(timings, "serialize"):
+                    record = {
+                        "type": "level",
+                        "depth": depth,
+                        "nodes": serialize_nodes(network, nodes_sent, labels=labels),
+                        "edges": serialize_edges(network, edges_sent, labels=labels),
+                    }
+                    resent = sorted(row for row in network.updated_edges if row < edges_sent)
+                    if resent:
+                        record["updated_edges"] = [edge for row in resent
+                                                   for edge in serialize_edges(network, row, row + 1,
+                                                                               labels=labels)]
+                    network.updated_edges.clear()
+                    if nodes_sent == 0:
+                        record["target_id"] = str(network.target_id)
+                        record["target_gene"] = labels[network.target_id]
+                nodes_sent, edges_sent = network.num_nodes, network.num_edges
+                with stage_span(timings, "encode"):
+                    chunk = encode(record)
+                yield chunk
+            if nodes_sent == 0:
+                # max_depth 0: the target node is the whole network
+                nodes = serialize_nodes(network, labels=labels)
+                yield encode({"type": "level", "depth": 0, "nodes": nodes, "edges": [],
+                              "target_id": str(network.target_id),
+                              "target_gene": labels[network.target_id]})
+            summary = {
+                "type": "summary",
+                "summary": network.summary,
+                "degrees": {str(t): d for t, d in zip(network.node_ids, network.node_degrees)},
+            }
+            if network.summary.get("beam"):
+                # Beam expansion can move a node already sent up to a shallower depth
+                summary["depths"] = {str(t): d for t, d in zip(network.node_ids, network.node_depths)}
+            yield encode(summary)
+            record_networks(hosted, [network], timings)
+        except Exception as e:
+            if METRICS is not None:
+                METRICS.inc("gene_explorer_errors_total", endpoint="analyze_stream")
+            yield encode({"type": "error", "error": f"Analysis failed: {str(e)}"})
+        finally:
+            release()
+
+    response = app.response_class(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if use_sse else "application/x-ndjson",
+    )
+    response.call_on_close(release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Do not let proxies buffer the stream
+    return response
+
+CONTEXT_KEYS = ("timepoint", "dev_stage", "anatomy")
+
+# Keys a /api/analyze_batch "genes" entry may set for itself
+PANEL_ITEM_KEYS = ("gene_name",) + CONTEXT_KEYS
+
+@app.route("/api/analyze_batch", methods=["POST"])
+@app.route("/api/<model>/analyze_batch", methods=["POST"])
+def analyze_batch(model=None):
+    """
+    Panel variant of /api/analyze. The payload takes the /api/analyze
+    arguments plus "genes", a list of gene names or of objects with a
+    "gene_name" and any of "timepoint", "dev_stage" and "anatomy" to
+    override the shared context. All networks are expanded together (see
+    expand_networks) and each is streamed as soon as it is complete; "beam"
+    is rejected with 400:
+
+      {"type": "network", "index": i, "gene_name": ..., "context": {...},
+       "network": {...}}                  /api/analyze body (or columnar)
+      {"type": "error", "index": i, "error": ...}       unknown gene
+      {"type": "summary", "summary": {...}}             panel totals, last
+
+    Records are NDJSON, or Server-Sent Events when the client sends
+    Accept: text/event-stream.
+    """
+    hosted = hosted_model(model)
+    if hosted is None:
+        return jsonify({"error": f"Unknown model '{model}'."}), 404
+    data = request.json or {}
+    items = data.get('genes')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "'genes' must be a non-empty list."}), 400
+    max_panel_genes = CONFIG.get('max_panel_genes', 500)
+    if len(items) > max_panel_genes:
+        return jsonify({"error": f"At most {max_panel_genes} genes per batch."}), 400
+    if data.get('beam'):
+        # Panels expand level by level (expand_networks); there is no beam mode
+        return jsonify({"error": "\"beam\" is not supported by /api/analyze_batch; "
+                                 "use /api/analyze for best-first expansion."}), 400
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+
+    defaults = {key: value for key, value in data.items() if key != 'genes'}
+    entries = []
+    for item in items:
+        item = item if isinstance(item, dict) else {"gene_name": item}
+        overrides = {key: item[key] for key in PANEL_ITEM_KEYS if key in item}
+        params, error, status = parse_network_request({**defaults, **overrides}, hosted)
+        if status == 400:
+            return jsonify({"error": error}), 400
+        entries.append((params, error))
+    valid = [i for i, (params, _) in enumerate(entries) if params is not None]
+    timings = METRICS.request_timings() if METRICS is not None else None
+    cost = estimate_panel_cost([entries[i][0] for i in valid], hosted.config.get('vocab_size', 2000))
+    if valid:
+        rejection = admit_request(cost, entries[valid[0]][0]["deadline"])
+        if rejection is not None:
+            return rejection
+    release = stream_release(cost) if valid else (lambda: None)
+
+    def encode(record):
+        payload = encode_json(record)
+        if use_sse:
+            return b"event: " + record["type"].encode() + b"\ndata: " + payload + b"\n"
+        return payload
+
+    def generate():
+        start = time.perf_counter()
+        panel = {}
+        networks = []
+        contexts = []
+        for i in valid:
+            params = entries[i][0]
+            networks.append(NetworkBuilder(params["gene_id"], params["max_depth"]))
+            contexts.append((params["timepoint"], params["dev_stage"], params["anatomy"]))
+        try:
+            for i, (params, error) in enumerate(entries):
+                if error:
+                    yield encode({"type": "error", "index": i, "error": error})
+            finished = ()
+            if valid:
+                # max_depth and top_genes are the same for every entry
+                options = network_options(entries[valid[0]][0])
+                for key in CONTEXT_KEYS + ("beam",):
+                    del options[key]
+                options["timings"] = timings
+                finished = expand_networks(networks, contexts, panel=panel, **options)
+            for slot in finished:
+                i = valid[slot]
+                params = entries[i][0]
+                with stage_span(timings, "serialize"):
+                    if params["columnar"]:
+                        vis_data = prepare_network_columns(networks[slot])
+                    else:
+                        vis_data = prepare_network_for_visualization(networks[slot])
+                with stage_span(timings, "encode"):
+                    chunk = encode({
+                        "type": "network",
+                        "index": i,
+                        "gene_name": params["gene_name"],
+                        "context": dict(zip(CONTEXT_KEYS, contexts[slot])),
+                        "network": vis_data,
+                    })
+                yield chunk
+            panel.update(networks=len(networks), errors=len(entries) - len(valid),
+                         seconds=round(time.perf_counter() - start, 4))
+            if timings is not None:
+                panel.update(forward_passes=timings.forward_passes, forward_rows=timings.forward_rows)
+            record_networks(hosted, networks, timings)
+            yield encode({"type": "summary", "summary": panel})
+        except Exception as e:
+            if METRICS is not None:
+                METRICS.inc("gene_explorer_errors_total", endpoint="analyze_batch")
+            yield encode({"type": "error", "error": f"Analysis failed: {str(e)}"})
+        finally:
+            release()
+
+    response = app.response_class(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if use_sse else "application/x-ndjson",
+    )
+    response.call_on_close(release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def parse_contexts(spec):
+    """
+    (timepoint, dev_stage, anatomy) tuples of a request's "contexts": "all"
+    for every combination of the option lists, or a list of objects (missing
+    fields default to the server's context) or [timepoint, dev_stage,
+    anatomy] lists. Returns (contexts, error).
+    """
+    if spec == "all":
+        return known_contexts(), None
+    if not isinstance(spec, list) or not spec:
+        return None, "'contexts' must be \"all\" or a non-empty list."
+    contexts = []
+    for entry in spec:
+        if isinstance(entry, dict):
+            entry = [entry.get(key, CONFIG.get(key)) for key in CONTEXT_KEYS]
+        if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+            return None, f"Invalid context {entry!r}."
+        context = tuple(entry)
+        if context not in contexts:
+            contexts.append(context)
+    max_contexts = CONFIG.get('max_sweep_contexts', 500)
+    if len(contexts) > max_contexts:
+        return None, f"At most {max_contexts} contexts per sweep."
+    error = reserve_contexts(contexts)
+    if error:
+        return None, error
+    return contexts, None
+
+def serialize_edge_change(source, target, score_before, score_after):
+    return {
+        "source": str(source),
+        "target": str(target),
+        "source_gene": gene_label(source),
+        "target_gene": gene_label(target),
+        "score_before": score_before,
+        "score_after": score_after,
+        "delta": None if score_before is None or score_after is None else score_after - score_before,
+    }
+
+@app.route("/api/context_sweep", methods=["POST"])
+@app.route("/api/<model>/context_sweep", methods=["POST"])
+def context_sweep(model=None):
+    """
+    One gene across many contexts. Takes "gene_name", "top_genes",
+    "contexts" (see parse_contexts) and a "mode":
+
+      "matrix"        (default) the gene's top neighbours in every context
+                      as a neighbour x context score matrix (null where a
+                      neighbour is not in that context's top genes)
+      "differential"  exactly two contexts: the edges of the max_depth
+                      networks gained, lost and re-weighted (by at least
+                      "min_delta") going from the first context to the second
+
+    All contexts are expanded together (see expand_networks) and, unless
+    "shared_background" is false, each gene sees the same background tokens
+    in every context, so the inputs differ only in their context row and
+    score differences come from the context alone. With
+    "shared_background": false every context gets the network /api/analyze
+    would return for it (served from the caches and neighbour index).
+    """
+    hosted = hosted_model(model)
+    if hosted is None:
+        return jsonify({"error": f"Unknown model '{model}'."}), 404
+    data = request.json or {}
+    mode = data.get('mode', "matrix")
+    if mode not in ("matrix", "differential"):
+        return jsonify({"error": "'mode' must be \"matrix\" or \"differential\"."}), 400
+    contexts, error = parse_contexts(data.get('contexts'))
+    if error:
+        return jsonify({"error": error}), 400
+    if mode == "differential" and len(contexts) != 2:
+        return jsonify({"error": "Differential mode compares exactly two contexts."}), 400
+    if data.get('beam'):
+        # Contexts are expanded level by level together (expand_networks)
+        return jsonify({"error": "\"beam\" is not supported by /api/context_sweep."}), 400
+    params, error, status = parse_network_request(data, hosted)
+    if error:
+        return jsonify({"error": error}), status
+    max_depth = params["max_depth"] if mode == "differential" else 1
+    cost = estimate_request_cost(max_depth, params["top_genes"], params["ensemble"], len(contexts),
+                                 vocab_size=hosted.config.get('vocab_size', 2000))
+    rejection = admit_request(cost, params["deadline"])
+    if rejection is not None:
+        return rejection
+
+    try:
+        timings = params["timings"]
+        start = time.perf_counter()
+        networks = [NetworkBuilder(params["gene_id"], max_depth) for _ in contexts]
+        options = network_options(params)
+        for key in CONTEXT_KEYS + ("beam",):
+            del options[key]
+        if data.get('shared_background', True):
+            options.update(shared_background=True, expansion_cache=None, neighbour_index=None)
+        panel = {}
+        for _ in expand_networks(networks, contexts, panel=panel, **options):
+            pass
+
+        with stage_span(timings, "serialize"):
+            result = {
+                "mode": mode,
+                "gene_name": params["gene_name"],
+                "target_id": str(params["gene_id"]),
+                "contexts": [dict(zip(CONTEXT_KEYS, context)) for context in contexts],
+            }
+            if mode == "matrix":
+                neighbour_ids, scores = context_score_matrix(networks)
+                result["neighbours"] = [{"id": str(token_id), "label": gene_label(token_id)}
+                                        for token_id in neighbour_ids]
+                result["scores"] = scores
+            else:
+                gained, lost, reweighted, unchanged = diff_networks(
+                    networks[0], networks[1], min_delta=float(data.get('min_delta', 0.0))
+                )
+                result["gained"] = [serialize_edge_change(*edge) for edge in gained]
+                result["lost"] = [serialize_edge_change(*edge) for edge in lost]
+                result["reweighted"] = [serialize_edge_change(*edge) for edge in reweighted]
+                result["networks"] = [network.summary for network in networks]
+                result["unchanged"] = unchanged
+            result["summary"] = {
+                "contexts": len(contexts),
+                "top_genes": params["top_genes"],
+                "max_depth": max_depth,
+                "expansions": panel["unique_expansions"],
+                "expansion_cache_hits": sum(n.summary["expansion_cache_hits"] for n in networks),
+                "expansion_index_hits": sum(n.summary["expansion_index_hits"] for n in networks),
+                "truncated": any(n.summary["truncated"] for n in networks),
+                "seconds": round(time.perf_counter() - start, 4),
+            }
+            if timings is not None:
+                result["summary"]["forward_passes"] = timings.forward_passes
+        with stage_span(timings, "encode"):
+            body = encode_json(result)
+            encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""), len(body))
+            body = compress_body(body, encoding)
+        response = body_response(body, encoding)
+        record_networks(hosted, networks, timings)
+        if timings is not None and timings.totals:
+            response.headers["Server-Timing"] = timings.server_timing()
+        return response
+    except Exception as e:
+        return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
+    finally:
+        release_request(cost)
+
+@app.route("/api/get_gene_name/<token_id>")
+def get_gene_name(token_id):
+    """
+    Optional endpoint: given a numeric token ID, returns the corresponding gene name.
+    """
+    try:
+        gene_name = create_gene_label(token_id, INDEX2GENE)
+        return jsonify({"gene_name": gene_name})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def admin_allowed():
+    """
+    Whether the request may use /admin endpoints: it must carry
+    --admin_token in X-Admin-Token. Without a configured token they are
+    disabled, since behind a reverse proxy on the same host every client
+    looks like loopback.
+    """
+    token = CONFIG.get('admin_token')
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+def within_directory(path, reference):
+    """Whether path resolves to somewhere under the directory of the reference file."""
+    base = os.path.dirname(os.path.realpath(reference))
+    return os.path.commonpath([base, os.path.realpath(path)]) == base
+
+@app.route("/admin/reload", methods=["GET", "POST"])
+def admin_reload():
+    """
+    Hot-reload the model weights and gene mapping without dropping requests
+    (see reload_inference). POST starts a reload of the configured files, or
+    of the "weights_file" / "mapping_json" given in the body, and answers
+    202 straight away; "model" limits it to one hosted model. Body paths
+    must lie under the directory of the configured file they replace. GET
+    reports the progress of the latest one. Pre-forked workers forward the
+    reload to the supervisor, which reloads every worker from the
+    configured files.
+    """
+    if not CONFIG.get('admin_token'):
+        return jsonify({"error": "/admin endpoints are disabled; set --admin_token."}), 403
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden."}), 403
+    if request.method == "GET":
+        return jsonify(RELOAD_STATUS)
+
+    data = request.get_json(silent=True) or {}
+    weights_file = data.get('weights_file')
+    mapping_json = data.get('mapping_json')
+    model = data.get('model')
+    if model is not None and model != CONFIG.get('model_name') and model not in MODEL_ARGS:
+        return jsonify({"error": f"Unknown model '{model}'."}), 404
+    if model in MODEL_ARGS and mapping_json:
+        return jsonify({"error": "The gene mapping is shared; reload it without \"model\"."}), 400
+    if WORKER is not None:
+        if weights_file or mapping_json or model is not None:
+            return jsonify({"error": "Pre-forked servers reload from their configured files; "
+                                     "replace those and POST without a body."}), 400
+        os.kill(os.getppid(), signal.SIGHUP)
+        return jsonify({"status": "reloading", "workers": True}), 202
+    # Overrides stay next to the configured files; the weight cache is
+    # written (and cleared) beside whichever weights file is loaded
+    configured_weights = MODEL_ARGS[model].weights_file if model in MODEL_ARGS else CONFIG['weights_file']
+    for path, configured in ((weights_file, configured_weights), (mapping_json, CONFIG['mapping_json'])):
+        if path and not within_directory(path, configured):
+            return jsonify({"error": f"{path} is outside the directory of {configured}."}), 403
+        if path and not os.path.isfile(path):
+            return jsonify({"error": f"No such file: {path}"}), 400
+    if not start_reload(weights_file, mapping_json, reason="admin", model=model):
+        return jsonify({**RELOAD_STATUS, "error": "A reload is already running."}), 409
+    return jsonify({"status": "reloading", "generation": RELOAD_STATUS["generation"]}), 202
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    """
+    Simple health check endpoint so you can confirm the server is running.
+    Doubles as a readiness probe: it answers 503 until the model is warm and
+    while a pre-forked worker is draining.
+    """
+    if not READY or (WORKER is not None and WORKER.draining):
+        state = "draining" if READY else "starting"
+        return jsonify({"status": state, "pid": os.getpid()}), 503
+    status = {"status": "ok", "message": "Gene Explorer API is up and running.",
+              "pid": os.getpid()}
+    if WORKER is not None:
+        status["worker"] = WORKER.stats()
+    if RESPONSE_CACHE is not None:
+        status["response_cache"] = RESPONSE_CACHE.stats()
+    if EXPANSION_CACHE is not None:
+        status["expansion_cache"] = EXPANSION_CACHE.stats()
+    if NEIGHBOUR_INDEX is not None:
+        status["neighbour_index"] = NEIGHBOUR_INDEX.stats()
+    if SCHEDULER is not None:
+        status["scheduler"] = SCHEDULER.stats()
+    if ADMISSION is not None:
+        status["admission"] = ADMISSION.stats()
+    status["model"] = {"generation": RELOAD_STATUS["generation"], "reload": RELOAD_STATUS["state"],
+                       "weights_file": CONFIG.get('weights_file'),
+                       "mapping_json": CONFIG.get('mapping_json')}
+    status["models"] = {hosted.name: hosted.describe() for hosted in [hosted_model(), *MODELS.values()]}
+    return jsonify(status)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Counters and latency histograms of this process in the Prometheus text
+    format. Pre-forked workers each report their own.
+    """
+    if METRICS is None:
+        return jsonify({"error": "Metrics are disabled (--metrics off)."}), 404
+    return app.response_class(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.before_request
+def track_request_start():
+    if METRICS is not None:
+        g.request_start = time.perf_counter()
+    if WORKER is not None:
+        # Health probes and metric scrapes do not count towards worker recycling
+        WORKER.request_started(counted=request.endpoint not in ("health_check", "metrics"))
+
+@app.after_request
+def record_request_metrics(response):
+    if METRICS is not None and request.endpoint not in (None, "health_check", "metrics"):
+        METRICS.inc("gene_explorer_requests_total", endpoint=request.endpoint,
+                    status=str(response.status_code))
+        if response.status_code >= 500:
+            METRICS.inc("gene_explorer_errors_total", endpoint=request.endpoint)
+        if "request_start" in g:
+            METRICS.observe("gene_explorer_request_seconds", time.perf_counter() - g.request_start,
+                            endpoint=request.endpoint)
+    return response
+
+@app.teardown_request
+def track_request_end(exc=None):
+    if WORKER is not None:
+        WORKER.request_finished()
+
+# -------------------------------------------------------------------
+# Serving
+# -------------------------------------------------------------------
+class PreforkWorker:
+    """
+    Serving loop of one forked worker process. Accepts connections on the
+    listening socket inherited from the supervisor, and drains gracefully
+    (stops accepting, lets in-flight requests finish, exits) on SIGTERM or
+    after max_requests requests, so the supervisor can replace it.
+    """
+
+    def __init__(self, listen_fd, host, port, max_requests=0, graceful_timeout=30.0):
+        self.listen_fd = listen_fd
+        self.host = host
+        self.port = port
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.server = None
+        self.draining = False
+        self.handled = 0
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def request_started(self, counted=True):
+        with self._lock:
+            self.active += 1
+            self.handled += counted
+            recycle = counted and self.max_requests and self.handled >= self.max_requests
+        if recycle:
+            self.drain("served max_requests")
+
+    def request_finished(self):
+        with self._lock:
+            self.active -= 1
+
+    def drain(self, reason):
+        with self._lock:
+            if self.draining:
+                return
+            self.draining = True
+        print(f"Worker {os.getpid()} draining ({reason}).", flush=True)
+        # shutdown() blocks until serve_forever returns, so never call it
+        # from the serving thread itself
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def serve(self):
+        self.server = make_server(self.host, self.port, app, threaded=True, fd=self.listen_fd)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.drain("SIGTERM"))
+        print(f"Worker {os.getpid()} ready.", flush=True)
+        self.server.serve_forever()
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.active > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for scheduler in [SCHEDULER] + [hosted.scheduler for hosted in MODELS.values()]:
+            if scheduler is not None:
+                scheduler.close()
+
+    def stats(self):
+        with self._lock:
+            return {"handled": self.handled, "active": self.active,
+                    "max_requests": self.max_requests}
+
+def serve_prefork(args, layer_weights, model_weights=None):
+    """
+    Pre-fork supervisor. Everything loaded before this call (gene mapping,
+    context table, parsed weights of the main model and of the --model
+    variants in model_weights) is shared copy-on-write with the workers.
+    Each worker builds its own TensorFlow runtime with a bounded thread pool,
+    warms up, then serves from the shared listening socket. Workers that exit
+    are replaced; SIGTERM/SIGINT drain all of them and stop.
+
+    SIGHUP (also sent by a worker's POST /admin/reload, or by --watch_reload
+    noticing new files) reloads the supervisor's weights, mapping and
+    neighbour index for future workers, then forwards SIGHUP so every
+    running worker hot-reloads in place (see reload_inference).
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("0.0.0.0", args.port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+
+    workers = {}
+    stopping = []
+    reloads = []
+    loaded = {"layer_weights": layer_weights, "model_weights": model_weights or {}}
+    del layer_weights, model_weights
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            global WORKER
+            code = 1
+            try:
+                # The supervisor decides when workers stop
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGHUP, lambda signum, frame: start_reload(reason="SIGHUP"))
+                WORKER = PreforkWorker(
+                    listener.fileno(), "0.0.0.0", args.port,
+                    max_requests=args.max_requests, graceful_timeout=args.graceful_timeout,
+                )
+                init_inference(args, loaded["layer_weights"], StartupTimer(f"worker {os.getpid()}"),
+                               loaded["model_weights"])
+                WORKER.serve()
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        workers[pid] = time.monotonic()
+
+    def request_stop(signum, frame):
+        stopping.append(signum)
+
+    def reload_workers(reason):
+        # Load in the supervisor first, so a broken file never reaches the workers
+        # and replacements forked later start from the new state
+        global GENE2IDX, INDEX2GENE, GENE_LABELS, NEIGHBOUR_INDEX
+        print(f"Reloading all models ({reason})...", flush=True)
+        try:
+            gene2idx, index2gene = load_gene_mapping(args.mapping_json)
+            labels = build_label_table(index2gene, args.vocab_size)
+            layer_weights, _ = load_weights(args)
+            index = open_serving_index(args)
+            model_weights = {name: load_weights(MODEL_ARGS[name])[0] for name in loaded["model_weights"]}
+        except Exception:
+            traceback.print_exc()
+            print("Reload failed; workers keep serving the current model.", flush=True)
+            return
+        GENE2IDX, INDEX2GENE, GENE_LABELS, NEIGHBOUR_INDEX = gene2idx, index2gene, labels, index
+        loaded.update(layer_weights=layer_weights, model_weights=model_weights)
+        RELOAD_STATUS["generation"] += 1
+        for pid in workers:
+            os.kill(pid, signal.SIGHUP)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGHUP, lambda signum, frame: reloads.append("SIGHUP"))
+    # Polled from this loop: the supervisor must not start threads before forking
+    watcher = ReloadWatcher() if args.watch_reload > 0 else None
+    next_watch = time.monotonic() + args.watch_reload
+
+    print(f"Starting {args.workers} workers on port {args.port} "
+          f"({args.intra_op_threads} intra-op / {args.inter_op_threads} inter-op threads each)...",
+          flush=True)
+    for _ in range(args.workers):
+        spawn()
+
+    stop_deadline = None
+    while workers:
+        if stopping and stop_deadline is None:
+            print("Stopping workers...", flush=True)
+            stop_deadline = time.monotonic() + args.graceful_timeout
+            for pid in workers:
+                os.kill(pid, signal.SIGTERM)
+        if stop_deadline is not None and time.monotonic() > stop_deadline:
+            for pid in workers:
+                os.kill(pid, signal.SIGKILL)
+        if watcher is not None and time.monotonic() >= next_watch:
+            next_watch = time.monotonic() + args.watch_reload
+            if reloads:
+                watcher.reset()
+            elif watcher.poll():
+                reloads.append("file change")
+        if reloads and not stopping:
+            reason = reloads[0]
+            reloads.clear()
+            reload_workers(reason)
+
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        exit_code = os.waitstatus_to_exitcode(status)
+        print(f"Worker {pid} exited with code {exit_code}; starting a replacement.", flush=True)
+        if exit_code != 0 and time.monotonic() - started < 10:
+            time.sleep(1)  # Back off instead of spinning on a worker that cannot start
+        spawn()
+    listener.close()
+
+# -------------------------------------------------------------------
+# Main / Initialization
+# -------------------------------------------------------------------
+class StartupTimer:
+    """Wall-clock timing of named startup phases, printed as a breakdown."""
+
+    def __init__(self, name="startup"):
+        self.name = name
+        self.phases = []
+
+    @contextmanager
+    def phase(self, label):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((label, time.perf_counter() - start))
+
+    def report(self):
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"{self.name.capitalize()} breakdown ({total:.2f} s total):")
+        for label, seconds in self.phases:
+            print(f"  {label:<24} {seconds * 1000:9.1f} ms")
+        sys.stdout.flush()
+
+def read_h5_weights(path):
+    """
+    Read a Keras H5 weights file into NumPy without touching TensorFlow.
+    Returns one list of arrays per weighted layer, in file order (the order
+    load_weights would assign them).
+    """
+    import h5py
+
+    layer_weights = []
+    with h5py.File(path, "r") as f:
+        group = f["model_weights"] if "layer_names" not in f.attrs else f
+        for layer_name in group.attrs["layer_names"]:
+            layer_name = layer_name.decode("utf-8") if isinstance(layer_name, bytes) else layer_name
+            layer_group = group[layer_name]
+            weight_names = layer_group.attrs.get("weight_names", [])
+            if len(weight_names):
+                layer_weights.append([
+                    np.asarray(layer_group[n.decode("utf-8") if isinstance(n, bytes) else n])
+                    for n in weight_names
+                ])
+    return layer_weights
+
+def weights_fingerprint(path):
+    """Size and mtime of a weights file; any change invalidates derived artifacts."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def write_weight_artifact(cache_dir, layer_weights, fingerprint):
+    """
+    Store layer weights as one flat, 64-byte aligned binary plus a JSON index
+    of (dtype, shape, offset) per array, so later starts can memory-map them.
+    """
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    layers = []
+    offset = 0
+    with open(os.path.join(tmp_dir, "weights.bin"), "wb") as f:
+        for values in layer_weights:
+            entries = []
+            for value in values:
+                value = np.ascontiguousarray(value)
+                padding = -offset % 64
+                f.write(b"\0" * padding)
+                offset += padding
+                entries.append({"dtype": value.dtype.str, "shape": list(value.shape), "offset": offset})
+                f.write(value.tobytes())
+                offset += value.nbytes
+            layers.append(entries)
+    with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+        json.dump({"source": fingerprint, "layers": layers}, f)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+def map_weight_artifact(cache_dir, index):
+    """Read-only memory-mapped views of every array in a weight artifact."""
+    blob = np.memmap(os.path.join(cache_dir, "weights.bin"), dtype=np.uint8, mode="r")
+    layer_weights = []
+    for entries in index["layers"]:
+        values = []
+        for entry in entries:
+            dtype = np.dtype(entry["dtype"])
+            count = int(np.prod(entry["shape"]))
+            values.append(np.frombuffer(blob, dtype=dtype, count=count, offset=entry["offset"])
+                          .reshape(entry["shape"]))
+        layer_weights.append(values)
+    return layer_weights
+
+def load_layer_weights(path, cache_dir=None):
+    """
+    Layer weights for a Keras H5 file, served from a memory-mapped artifact
+    in cache_dir (default: <path>.npcache). The artifact is converted from
+    the H5 file on first use and rebuilt whenever the H5 file changes.
+    Returns (layer_weights, source) with source "cache" or "h5".
+    """
+    cache_dir = cache_dir or f"{path}.npcache"
+    fingerprint = weights_fingerprint(path)
+    try:
+        with open(os.path.join(cache_dir, "index.json")) as f:
+            index = json.load(f)
+        if index["source"] == fingerprint:
+            return map_weight_artifact(cache_dir, index), "cache"
+    except (OSError, ValueError, KeyError):
+        pass
+
+    layer_weights = read_h5_weights(path)
+    try:
+        write_weight_artifact(cache_dir, layer_weights, fingerprint)
+    except OSError as e:
+        print(f"Warning: could not write weight cache {cache_dir}: {e}")
+    return layer_weights, "h5"
+
+def build_runner(args, layer_weights, precision="float32", timer=None):
+    """
+    Build a tsGPTv207WithAttention at the given precision (see
+    tsgpt_model.PRECISIONS), load layer_weights into it and wrap it in an
+    InferenceRunner over CONTEXTS. Returns (model, runner).
+    """
+    import tsgpt_model
+
+    timer = timer or StartupTimer()
+
+    # Initialize model, creating the variables from known shapes
+    print(f"Initializing tsGPTv207WithAttention model ({precision})...")
+    with timer.phase("build model variables"):
+        with tsgpt_model.precision_policy(precision):
+            model = tsgpt_model.tsGPTv207WithAttention(
+                vocab_size=args.vocab_size,
+                embed_dim=args.embedding_dim,
+                num_heads=args.num_heads,
+                ff_dim=args.ff_dim,
+                num_blocks=args.num_blocks,
+                dropout=args.dropout,
+                metadata_dim=args.metadata_dim,
+                timepoint_classes=args.timepoint_classes,
+                stage_classes=args.stage_classes,
+                anatomy_classes=args.anatomy_classes,
+            )
+            model.build_from_shapes(SEQ_LEN)
+
+    with timer.phase("assign weights"):
+        tsgpt_model.assign_layer_weights(model, layer_weights)
+        if precision == "int8":
+            tsgpt_model.quantize_dense_layers(model)
+    print("Model weights loaded successfully.")
+
+    with timer.phase("project contexts"):
+        runner = tsgpt_model.InferenceRunner(
+            model,
+            seq_len=SEQ_LEN,
+            batch_buckets=[int(b) for b in args.batch_buckets.split(",")],
+            jit_compile=args.jit_compile,
+            compiled=not args.eager,
+        )
+        runner.attach_contexts(CONTEXTS)
+    return model, runner
+
+def build_numpy_runner(args, layer_weights, timer=None):
+    """
+    NumPy counterpart of build_runner: a NumpyTsGPT over layer_weights
+    wrapped in a NumpyInferenceRunner over CONTEXTS, without importing
+    TensorFlow. Returns (model, runner).
+    """
+    import numpy_engine
+
+    timer = timer or StartupTimer()
+    print("Initializing NumPy tsGPTv207WithAttention engine...")
+    with timer.phase("load NumPy engine"):
+        model = numpy_engine.NumpyTsGPT(layer_weights)
+    with timer.phase("project contexts"):
+        runner = numpy_engine.NumpyInferenceRunner(
+            model,
+            seq_len=SEQ_LEN,
+            batch_buckets=[int(b) for b in args.batch_buckets.split(",")],
+        )
+        runner.attach_contexts(CONTEXTS)
+    return model, runner
+
+def fidelity_report(args, layer_weights, modes, num_genes=32, num_contexts=4):
+    """
+    Compare inference modes against the TensorFlow float32 model on the same
+    sample of genes and contexts (deterministic inputs). A mode is one of
+    PRECISIONS, or "numpy" for the NumPy engine. For every mode, returns the
+    mean and minimum top-N neighbour overlap and Pearson correlation of the
+    per-token scores, the largest absolute attention difference, and
+    steady-state rows per second.
+    """
+    top_n = args.top_genes
+    rng = np.random.default_rng(stable_seed("fidelity", num_genes, num_contexts))
+    known_ids = sorted({int(v) for v in GENE2IDX.values() if int(v) < args.vocab_size})
+    gene_ids = [int(g) for g in rng.choice(known_ids, size=min(num_genes, len(known_ids)), replace=False)]
+    contexts = [
+        (TIMEPOINT_OPTIONS[rng.integers(len(TIMEPOINT_OPTIONS))],
+         DEVELOPMENTAL_STAGE_OPTIONS[rng.integers(len(DEVELOPMENTAL_STAGE_OPTIONS))],
+         ANATOMY_OPTIONS[rng.integers(len(ANATOMY_OPTIONS))])
+        for _ in range(num_contexts)
+    ]
+
+    report = {"genes": len(gene_ids), "contexts": contexts, "top_n": top_n, "modes": {}}
+    reference = None
+    for mode in ["float32"] + [m for m in modes if m != "float32"]:
+        if mode == "numpy":
+            _, runner = build_numpy_runner(args, layer_weights)
+        else:
+            _, runner = build_runner(args, layer_weights, mode)
+        scores = []
+        attention = []
+        elapsed = 0.0
+        for timepoint, dev_stage, anatomy in contexts:
+            for start in range(0, len(gene_ids), runner.max_batch_size):
+                inputs, center_pos = create_batch_input_data(
+                    gene_ids[start:start + runner.max_batch_size], timepoint, dev_stage, anatomy,
+                    vocab_size=args.vocab_size, deterministic=True
+                )
+                runner.center_attention(inputs)  # trace and warm this bucket
+                t0 = time.perf_counter()
+                attn_from, attn_to = runner.center_attention(inputs)
+                elapsed += time.perf_counter() - t0
+                attention.append((attn_from, attn_to))
+                # Score every token so correlations see the whole distribution
+                scores.extend(score_center_attention(
+                    attn_from, attn_to, inputs["gene_tokens"], center_pos, top_n=SEQ_LEN
+                ))
+        if reference is None:
+            reference = scores
+            reference_attention = attention
+        max_abs_diff = max(
+            float(max(np.abs(a_from - r_from).max(), np.abs(a_to - r_to).max()))
+            for (a_from, a_to), (r_from, r_to) in zip(attention, reference_attention)
+        )
+
+        overlaps = []
+        correlations = []
+        for ref, got in zip(reference, scores):
+            ref_top = list(ref)[:top_n]
+            overlaps.append(len(set(ref_top) & set(list(got)[:top_n])) / max(len(ref_top), 1))
+            tokens = list(ref)
+            a = np.array([ref[t] for t in tokens])
+            b = np.array([got.get(t, 0.0) for t in tokens])
+            correlations.append(float(np.corrcoef(a, b)[0, 1]) if len(tokens) > 1 else 1.0)
+        report["modes"][mode] = {
+            "overlap_mean": float(np.mean(overlaps)),
+            "overlap_min": float(np.min(overlaps)),
+            "pearson_mean": float(np.mean(correlations)),
+            "pearson_min": float(np.min(correlations)),
+            "max_abs_diff": max_abs_diff,
+            "rows_per_sec": len(scores) / elapsed,
+        }
+    return report
+
+def print_fidelity_report(report):
+    base_rate = report["modes"]["float32"]["rows_per_sec"]
+    print(f"Fidelity vs TensorFlow float32: {report['genes']} genes x "
+          f"{len(report['contexts'])} contexts, top {report['top_n']} neighbours")
+    print(f"  {'mode':<10}{'overlap mean/min':>20}{'pearson mean/min':>24}"
+          f"{'max |diff|':>12}{'rows/s':>10}{'speedup':>9}")
+    for mode, m in report["modes"].items():
+        print(f"  {mode:<10}{m['overlap_mean']:>12.3f} / {m['overlap_min']:.3f}"
+              f"{m['pearson_mean']:>14.5f} / {m['pearson_min']:.5f}"
+              f"{m['max_abs_diff']:>12.2e}"
+              f"{m['rows_per_sec']:>10.1f}{m['rows_per_sec'] / base_rate:>8.2f}x")
+    sys.stdout.flush()
+
+_INDEX_WORKER = None  # (args, runner, index) inside a neighbour index build process
+
+def _neighbour_index_worker_init(args, layer_weights, path):
+    global _INDEX_WORKER
+    if args.engine == "numpy":
+        _, runner = build_numpy_runner(args, layer_weights)
+    else:
+        import tsgpt_model
+        tsgpt_model.configure_tf_threads(args.intra_op_threads, args.inter_op_threads)
+        _, runner = build_runner(args, layer_weights, args.precision)
+    _INDEX_WORKER = (args, runner, NeighbourIndex(path, mode="r+"))
+
+def _neighbour_index_worker_run(task):
+    args, runner, index = _INDEX_WORKER
+    row, timepoint, dev_stage, anatomy, gene_ids = task
+    inputs, center_pos = create_batch_input_data(
+        gene_ids, timepoint, dev_stage, anatomy, vocab_size=args.vocab_size, deterministic=True
+    )
+    attn_from, attn_to = runner.center_attention(inputs)
+    relationships = score_center_attention(
+        attn_from, attn_to, inputs["gene_tokens"], center_pos, top_n=index.top_k
+    )
+    index.write(row, gene_ids, relationships)
+    return len(gene_ids)
+
+def build_neighbour_index(args, layer_weights, path, processes=1, max_contexts=None):
+    """
+    Sweep every (mapped gene, known context) pair through the model with
+    deterministic sampling and store each gene's top-K neighbours in a
+    NeighbourIndex at path.
+
+    Work is spread over `processes` forked workers, each with its own model,
+    writing straight into the shared memory-mapped arrays. Rows filled by an
+    earlier run over the same weights are skipped, so an interrupted build
+    resumes; an index over other weights or settings is replaced.
+    max_contexts limits the run to the first contexts in table order.
+    """
+    meta = NeighbourIndex.metadata(
+        weights_fingerprint(args.weights_file), args.vocab_size, args.neighbour_index_top_k
+    )
+    try:
+        index = NeighbourIndex(path)
+        if index.meta != meta:
+            print(f"Neighbour index {path} is stale; rebuilding it.")
+            index = None
+    except (OSError, ValueError, KeyError):
+        index = None
+    if index is None:
+        index = NeighbourIndex.create(path, meta)
+
+    gene_ids = sorted({int(v) for v in GENE2IDX.values() if 0 <= int(v) < args.vocab_size})
+    tasks = []
+    for row, (timepoint, dev_stage, anatomy) in enumerate(meta["contexts"][:max_contexts]):
+        todo = [g for g in gene_ids if not index.filled[row, g]]
+        for start in range(0, len(todo), args.max_batch_size):
+            tasks.append((row, timepoint, dev_stage, anatomy, todo[start:start + args.max_batch_size]))
+    total = sum(len(task[-1]) for task in tasks)
+    print(f"Neighbour index {path}: {total} of {index.filled.size} rows to compute "
+          f"(top {index.top_k}) with {processes} processes.")
+    del index
+    if not total:
+        return
+
+    done = 0
+    start = last_report = time.perf_counter()
+    pool = multiprocessing.get_context("fork").Pool(
+        processes, initializer=_neighbour_index_worker_init, initargs=(args, layer_weights, path)
+    )
+    with pool:
+        for rows in pool.imap_unordered(_neighbour_index_worker_run, tasks):
+            done += rows
+            now = time.perf_counter()
+            if now - last_report >= 10 or done == total:
+                last_report = now
+                rate = done / (now - start)
+                print(f"  {done}/{total} rows, {rate:.1f} rows/s, "
+                      f"{(total - done) / rate / 60:.1f} min left")
+                sys.stdout.flush()
+
+def build_inference(args, layer_weights, timer, warmup):
+    """
+    Build the configured engine over layer_weights and warm it (see
+    --warmup). Returns (model, runner).
+    """
+    if args.engine == "numpy":
+        model, runner = build_numpy_runner(args, layer_weights, timer)
+    else:
+        with timer.phase("import TensorFlow"):
+            import tsgpt_model
+            tsgpt_model.configure_tf_threads(args.intra_op_threads, args.inter_op_threads)
+        model, runner = build_runner(args, layer_weights, args.precision, timer)
+
+    # Trace every bucket up front so no user request pays the tracing cost;
+    # with --warmup none each bucket is traced by the first request using it
+    if warmup != "none":
+        print(f"Warming inference buckets {runner.batch_buckets} (jit_compile={args.jit_compile})...")
+        with timer.phase("trace buckets"):
+            repeats = 3 if warmup == "full" else 0
+            for bucket, first_call, steady in runner.warmup(repeats=repeats):
+                if repeats:
+                    print(f"  batch {bucket:>3}: first call {first_call * 1000:.1f} ms, "
+                          f"steady state {steady * 1000:.1f} ms")
+                else:
+                    print(f"  batch {bucket:>3}: first call {first_call * 1000:.1f} ms")
+    return model, runner
+
+def build_scheduler(args, runner):
+    """The cross-request InferenceScheduler over runner, or None when batching is off."""
+    if args.batching_delay_ms <= 0:
+        return None
+    return InferenceScheduler(
+        runner,
+        max_batch_size=min(args.max_batch_size, runner.max_batch_size),
+        max_delay=args.batching_delay_ms / 1000,
+    )
+
+def build_caches(args):
+    """Empty (response cache, expansion cache) for a model served under args; None where disabled."""
+    response_cache = expansion_cache = None
+    if args.sampling == "deterministic" and args.response_cache_mb > 0:
+        response_cache = ResponseCache(max_bytes=int(args.response_cache_mb * 1024 * 1024))
+    if args.sampling == "deterministic" and args.expansion_cache_size > 0:
+        expansion_cache = ExpansionCache(max_entries=args.expansion_cache_size)
+    return response_cache, expansion_cache
+
+def build_hosted_model(name, args, layer_weights, timer, warmup):
+    """
+    A warm HostedModel over layer_weights, with its own scheduler, neighbour
+    index and empty caches, configured by args.
+    """
+    print(f"Building model '{name}' from {args.weights_file}...")
+    model, runner = build_inference(args, layer_weights, timer, warmup)
+    with timer.phase("neighbour index"):
+        index = open_serving_index(args)
+    return HostedModel(name, vars(args), model, runner, build_scheduler(args, runner), index,
+                       *build_caches(args))
+
+def init_inference(args, layer_weights, timer, model_weights=None):
+    """
+    Build the model, load weights, warm every bucket and start the
+    scheduler; then the same for every --model variant in model_weights
+    (layer weights by name).
+    """
+    global MODEL, RUNNER, SCHEDULER, READY
+
+    MODEL, RUNNER = build_inference(args, layer_weights, timer, args.warmup)
+    SCHEDULER = build_scheduler(args, RUNNER)
+    for name, weights in (model_weights or {}).items():
+        MODELS[name] = build_hosted_model(name, MODEL_ARGS[name], weights, timer, MODEL_ARGS[name].warmup)
+    timer.report()
+    READY = True
+
+def parse_model_spec(parser, args, spec):
+    """
+    Settings of a --model NAME=WEIGHTS_FILE[,option=value...] variant: the
+    server's arguments with its own weights file and any MODEL_OPTIONS
+    given (a flag option without "=value" is switched on). List options
+    separate their items with "+", e.g. batch_buckets=1+2+4. Its weight
+    artifact and neighbour index sit next to its weights file unless set.
+    Returns (name, args).
+    """
+    name, _, rest = spec.partition("=")
+    weights_file, *fields = rest.split(",")
+    if not name or not name.replace("-", "").replace("_", "").isalnum() or not weights_file:
+        parser.error(f"--model {spec!r}: expected NAME=WEIGHTS_FILE[,option=value...] "
+                     f"with a name of letters, digits, '-' and '_'")
+    if name == args.model_name or name in MODEL_ARGS:
+        parser.error(f"--model {spec!r}: model name '{name}' is already in use")
+    argv = ["--weights_file", weights_file, "--mapping_json", args.mapping_json]
+    for field in fields:
+        option, has_value, value = field.partition("=")
+        if option not in MODEL_OPTIONS:
+            parser.error(f"--model {spec!r}: '{option}' cannot be set per model; "
+                         f"choose from {', '.join(MODEL_OPTIONS)}")
+        if option in MODEL_LIST_OPTIONS:
+            value = value.replace("+", ",")
+        argv += [f"--{option}", value] if has_value else [f"--{option}"]
+    base = argparse.Namespace(**{**vars(args), "weights_cache_dir": None, "neighbour_index": None})
+    model_args = parser.parse_args(argv, namespace=base)
+    if model_args.engine == "numpy" and model_args.precision != "float32":
+        parser.error(f"--model {name}: engine numpy only supports precision float32")
+    return name, model_args
+
+def load_gene_mapping(path):
+    """(gene2idx, index2gene) dicts from a gene->token ID JSON file."""
+    with open(path, "r") as f:
+        gene_map = json.load(f)
+    return gene_map, {str(v): k for k, v in gene_map.items()}
+
+def load_weights(args):
+    """Layer weights of args.weights_file, honouring --no_weights_cache. Returns (layer_weights, source)."""
+    if args.no_weights_cache:
+        return read_h5_weights(args.weights_file), "h5"
+    return load_layer_weights(args.weights_file, args.weights_cache_dir)
+
+def open_serving_index(args):
+    """The NeighbourIndex matching args.weights_file, or None when unavailable or disabled."""
+    if args.sampling != "deterministic" or args.no_neighbour_index:
+        return None
+    index_path = args.neighbour_index or f"{args.weights_file}.neighbours"
+    index = open_neighbour_index(index_path, weights_fingerprint(args.weights_file), args.vocab_size)
+    if index is not None:
+        stats = index.stats()
+        print(f"Serving expansions from neighbour index {index_path} "
+              f"({stats['rows_filled']}/{stats['rows']} rows, top {stats['top_k']}).")
+    return index
+
+def switch_weights(args, weights_file=None):
+    """
+    A copy of model settings args serving weights_file instead. Another
+    file gets the weight artifact and neighbour index next to it.
+    """
+    args = argparse.Namespace(**vars(args))
+    if weights_file and weights_file != args.weights_file:
+        args.weights_file, args.weights_cache_dir, args.neighbour_index = weights_file, None, None
+    return args
+
+def retire_scheduler(scheduler, grace):
+    """Close a replaced InferenceScheduler once requests still using it have had grace seconds."""
+    if scheduler is None:
+        return
+    timer = threading.Timer(grace, scheduler.close)
+    timer.daemon = True
+    timer.start()
+
+def reload_inference(weights_file=None, mapping_json=None, reason="request", model=None):
+    """
+    Zero-downtime reload of the model weights and gene mapping (by default
+    the configured files, re-read from disk). Without a model name this
+    reloads the main model, the mapping and every --model variant from its
+    own file; naming a model reloads only that one, from weights_file when
+    given.
+
+    Replacement runners, schedulers, neighbour indexes and the mapping are
+    built and warmed next to the serving ones, then swapped in under
+    SWAP_LOCK; the response and expansion caches start empty since they
+    hold the old model's results. Requests already running finish on the
+    HostedModel they started with (see hosted_model), and the old
+    schedulers are closed after a grace period. Labels are resolved when a
+    network is serialized, so a request that straddles a mapping change is
+    labelled with the new mapping. On failure the serving models are left
+    untouched and the error is kept in RELOAD_STATUS.
+    """
+    global MODEL, RUNNER, SCHEDULER, NEIGHBOUR_INDEX, RESPONSE_CACHE, EXPANSION_CACHE
+    global GENE2IDX, INDEX2GENE, GENE_LABELS, MODELS
+
+    reload_main = model is None or model == CONFIG.get('model_name')
+    variants = list(MODEL_ARGS) if model is None else [name for name in MODEL_ARGS if name == model]
+    args = switch_weights(argparse.Namespace(**CONFIG), weights_file if reload_main else None)
+    mapping_json = mapping_json or args.mapping_json
+    # The weights file reported in RELOAD_STATUS
+    reported = args if reload_main else switch_weights(MODEL_ARGS[model], weights_file)
+    RELOAD_STATUS.update(state="reloading", reason=reason, model=model, weights_file=reported.weights_file,
+                         mapping_json=mapping_json, started=time.time(), error=None)
+    print(f"Reloading {model or 'all models'} ({reason})...", flush=True)
+    timer = StartupTimer("reload")
+    try:
+        if reload_main:
+            with timer.phase("load gene mapping"):
+                gene2idx, index2gene = load_gene_mapping(mapping_json)
+            with timer.phase("label table"):
+                labels = build_label_table(index2gene, args.vocab_size)
+            with timer.phase("load weights"):
+                layer_weights, _ = load_weights(args)
+            # Never hand live traffic an untraced runner, even with --warmup none
+            main = build_hosted_model(args.model_name, args, layer_weights, timer,
+                                      "trace" if args.warmup == "none" else args.warmup)
+        replacements = {}
+        for name in variants:
+            model_args = switch_weights(MODEL_ARGS[name], None if reload_main else weights_file)
+            with timer.phase(f"load weights ({name})"):
+                layer_weights, _ = load_weights(model_args)
+            replacements[name] = build_hosted_model(
+                name, model_args, layer_weights, timer,
+                "trace" if model_args.warmup == "none" else model_args.warmup)
+    except Exception as e:
+        traceback.print_exc()
+        RELOAD_STATUS.update(state="failed", error=str(e), seconds=time.time() - RELOAD_STATUS["started"])
+        return False
+
+    retired = [MODELS[name].scheduler for name in replacements if name in MODELS]
+    with SWAP_LOCK:
+        if reload_main:
+            retired.append(SCHEDULER)
+            (MODEL, RUNNER, SCHEDULER, NEIGHBOUR_INDEX, RESPONSE_CACHE, EXPANSION_CACHE) = (
+                main.model, main.runner, main.scheduler, main.neighbour_index,
+                main.response_cache, main.expansion_cache)
+            GENE2IDX, INDEX2GENE, GENE_LABELS = gene2idx, index2gene, labels
+            CONFIG.update(weights_file=args.weights_file, weights_cache_dir=args.weights_cache_dir,
+                          neighbour_index=args.neighbour_index, mapping_json=mapping_json)
+        MODELS = {**MODELS, **replacements}
+    for name, hosted in replacements.items():
+        MODEL_ARGS[name] = argparse.Namespace(**hosted.config)
+    for scheduler in retired:
+        retire_scheduler(scheduler, max(args.graceful_timeout, args.request_deadline))
+
+    RELOAD_STATUS.update(state="idle", generation=RELOAD_STATUS["generation"] + 1,
+                         fingerprint=weights_fingerprint(reported.weights_file), last_reload=time.time(),
+                         seconds=time.time() - RELOAD_STATUS["started"])
+    timer.report()
+    return True
+
+def start_reload(weights_file=None, mapping_json=None, reason="request", model=None):
+    """
+    Run reload_inference in a background thread. Returns False, without
+    starting anything, while another reload is in progress.
+    """
+    if not RELOAD_LOCK.acquire(blocking=False):
+        print(f"Reload already in progress; ignoring {reason} request.", flush=True)
+        return False
+
+    def run():
+        try:
+            reload_inference(weights_file, mapping_json, reason, model)
+        finally:
+            RELOAD_LOCK.release()
+    threading.Thread(target=run, daemon=True, name="model-reload").start()
+    return True
+
+class ReloadWatcher:
+    """
+    Notices changes to the configured weights and mapping files, including
+    those of --model variants. poll() returns True once a change has been
+    stable for two consecutive polls, so a file that is still being copied
+    into place is not loaded half written. Paths are read from CONFIG and
+    MODEL_ARGS on every poll.
+    """
+
+    def __init__(self):
+        self.loaded = self.seen = self.signature()
+
+    @staticmethod
+    def signature():
+        signature = []
+        paths = [CONFIG.get('weights_file'), CONFIG.get('mapping_json')]
+        paths += [model_args.weights_file for model_args in MODEL_ARGS.values()]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reset(self):
+        """Treat the files as they are now as loaded (after a reload by other means)."""
+        self.loaded = self.seen = self.signature()
+
+    def poll(self):
+        current = self.signature()
+        changed = current != self.loaded and current == self.seen and None not in current
+        self.seen = current
+        if changed:
+            self.loaded = current
+        return changed
+
+def watch_reload(interval):
+    """Thread body for --watch_reload in single-process mode."""
+    watcher = ReloadWatcher()
+    generation = RELOAD_STATUS["generation"]
+    while True:
+        time.sleep(interval)
+        if RELOAD_STATUS["generation"] != generation or RELOAD_LOCK.locked():
+            # Reloaded through /admin/reload or SIGHUP, possibly to other paths
+            generation = RELOAD_STATUS["generation"]
+            watcher.reset()
+        elif watcher.poll():
+            start_reload(reason="file change")
+
+def build_arg_parser():
+    """Command-line options of the backend; benchmark.py reuses them."""
+    parser = argparse.ArgumentParser(description="Gene Network Inference Backend")
+    parser.add_argument("--weights_file", required=True, help="H5 file with model weights.")
     parser.add_argument("--mapping_json", required=True, help="JSON of gene->token ID.")
+    parser.add_argument("--weights_cache_dir", default=None,
+                        help="Where to keep the memory-mapped weight artifact "
+                             "(default: <weights_file>.npcache).")
+    parser.add_argument("--no_weights_cache", action="store_true",
+                        help="Always parse the H5 file instead of using the weight artifact.")
+    parser.add_argument("--neighbour_index", default=None,
+                        help="Directory of the precomputed neighbour index "
+                             "(default: <weights_file>.neighbours).")
+    parser.add_argument("--no_neighbour_index", action="store_true",
+                        help="Always run live inference, even when a neighbour index exists.")
+    parser.add_argument("--build_neighbour_index", action="store_true",
+                        help="Compute (or resume) the neighbour index for every gene and "
+                             "known context, then exit.")
+    parser.add_argument("--neighbour_index_top_k", type=int, default=50,
+                        help="Neighbours stored per gene and context in the index.")
+    parser.add_argument("--index_processes", type=int, default=0,
+                        help="Processes used by --build_neighbour_index (0 = one per core).")
+    parser.add_argument("--index_max_contexts", type=int, default=None,
+                        help="Only build the first N contexts in this run.")
+    parser.add_argument("--metrics", choices=["full", "light", "off"], default="full",
+                        help="Instrumentation exposed on /metrics: per-stage timing "
+                             "histograms plus counters (full), only counters and request "
+                             "latency for negligible hot-path cost (light), or none (off).")
+    parser.add_argument("--admission_capacity", type=int, default=2048,
+                        help="Estimated forward-pass rows of network requests allowed to run at once "
+                             "(per process); a costlier request runs alone. 0 disables admission control.")
+    parser.add_argument("--admission_queue", type=int, default=32,
+                        help="Requests that may wait for admission before new ones get 429.")
+    parser.add_argument("--admission_timeout", type=float, default=30.0,
+                        help="Longest wait for admission, in seconds.")
+    parser.add_argument("--max_request_cost", type=int, default=0,
+                        help="Reject requests estimated above this many forward-pass rows (0: no limit).")
+    parser.add_argument("--request_deadline", type=float, default=60.0,
+                        help="Seconds after which a network request stops expanding and returns "
+                             "its partial network (0: no deadline).")
+    parser.add_argument("--beam_max_expanded", type=int, default=0,
+                        help="Default cap on nodes expanded by a \"beam\" request (0: none).")
+    parser.add_argument("--max_ensemble", type=int, default=64,
+                        help="Largest \"ensemble\" (background draws per node) a request may ask for.")
+    parser.add_argument("--max_panel_genes", type=int, default=500,
+                        help="Most genes accepted by one /api/analyze_batch request.")
+    parser.add_argument("--max_sweep_contexts", type=int, default=500,
+                        help="Most contexts accepted by one /api/context_sweep request.")
+    parser.add_argument("--no_compression", action="store_true",
+                        help="Never gzip/brotli-compress /api/analyze responses.")
+    parser.add_argument("--compress_min_bytes", type=int, default=1024,
+                        help="Smallest /api/analyze body worth compressing.")
     parser.add_argument("--initial_gene", default="klf3", help="Default gene.")
     parser.add_argument("--timepoint", default="2dpf", help="Default timepoint context.")
     parser.add_argument("--dev_stage", default="larval-5dpf", help="Default dev stage context.")
     parser.add_argument("--anatomy", default="hematopoietic_system", help="Default anatomy context.")
     parser.add_argument("--port", type=int, default=5000, help="Server port.")
+    parser.add_argument("--model_name", default="main",
+                        help="Name of the --weights_file model in /api/<model>/... routes and stats.")
+    parser.add_argument("--model", action="append", default=[], metavar="NAME=WEIGHTS_FILE[,option=value...]",
+                        help="Also serve another model variant at /api/NAME/analyze (and the other "
+                             "/api/NAME/... routes), sharing this process, its gene mapping and "
+                             "context table. Options override per-model settings, e.g. "
+                             "perturb=perturb.h5,num_blocks=6,batch_buckets=1+8+32. Repeatable.")
     
     parser.add_argument("--network_depth", type=int, default=3, choices=[1, 2, 3],
                         help="Max network depth (1=primary, 2=secondary, 3=tertiary).")
     parser.add_argument("--top_genes", type=int, default=13, help="Number of top genes per level.")
+    parser.add_argument("--max_batch_size", type=int, default=64,
+                        help="Max genes per forward pass when expanding a network level.")
+    parser.add_argument("--batch_buckets", default=",".join(str(b) for b in DEFAULT_BATCH_BUCKETS),
+                        help="Comma-separated padded batch sizes to compile and warm at startup.")
+    parser.add_argument("--jit_compile", action="store_true",
+                        help="Compile the inference graphs with XLA.")
+    parser.add_argument("--eager", action="store_true",
+                        help="Run inference eagerly instead of through compiled graphs.")
+    parser.add_argument("--engine", choices=ENGINES, default="tensorflow",
+                        help="Inference engine. numpy runs the attention path with plain "
+                             "NumPy/BLAS and never imports TensorFlow (float32 only).")
+    parser.add_argument("--parity_check", action="store_true",
+                        help="Compare the NumPy engine against the TensorFlow model on "
+                             "sampled genes and contexts; exit 1 if they disagree.")
+    parser.add_argument("--parity_atol", type=float, default=1e-5,
+                        help="Largest attention difference --parity_check accepts.")
+    parser.add_argument("--precision", choices=PRECISIONS, default="float32",
+                        help="Inference precision: reduced-precision compute (bfloat16, "
+                             "float16) or dynamic int8 quantization of the FFN and head "
+                             "Dense layers (int8). Check --fidelity_report first.")
+    parser.add_argument("--fidelity_report", action="store_true",
+                        help="Compare precision modes against float32 on sampled "
+                             "genes and contexts, print the report and exit.")
+    parser.add_argument("--fidelity_modes", default="bfloat16,int8,numpy",
+                        help="Comma-separated modes compared by --fidelity_report: "
+                             "precisions, or numpy for the NumPy engine. "
+                             "float16 is left out by default: without a GPU TensorFlow "
+                             "emulates it and it is orders of magnitude slower.")
+    parser.add_argument("--fidelity_genes", type=int, default=32,
+                        help="Genes sampled per context by --fidelity_report.")
+    parser.add_argument("--fidelity_contexts", type=int, default=4,
+                        help="Contexts sampled by --fidelity_report.")
+    parser.add_argument("--fidelity_output", default=None,
+                        help="Also write the --fidelity_report results to this JSON file.")
+    parser.add_argument("--warmup", choices=["full", "trace", "none"], default="full",
+                        help="Startup warmup: trace every bucket and log its steady-state "
+                             "latency (full), only trace them (trace), or trace each "
+                             "bucket on first use (none) for the fastest restart.")
+    parser.add_argument("--batching_delay_ms", type=float, default=2.0,
+                        help="Max time a queued expansion waits for other requests to share "
+                             "its forward pass (0 disables cross-request batching).")
+    parser.add_argument("--sampling", default="deterministic", choices=["deterministic", "random"],
+                        help="Background tokens seeded per (gene, context), or drawn at random.")
+    parser.add_argument("--response_cache_mb", type=float, default=256,
+                        help="Memory cap of the /api/analyze response cache (0 disables it).")
+    parser.add_argument("--expansion_cache_size", type=int, default=100000,
+                        help="Max cached per-node expansions shared across requests (0 disables it).")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Pre-forked worker processes (0 runs Flask's single-process server).")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="TF intra-op threads per process (0: TF default, or cores/workers "
+                             "when pre-forking).")
+    parser.add_argument("--inter_op_threads", type=int, default=0,
+                        help="TF inter-op threads per process (0: TF default, or 1 when pre-forking).")
+    parser.add_argument("--max_requests", type=int, default=0,
+                        help="Recycle a worker after this many requests (0 never recycles).")
+    parser.add_argument("--graceful_timeout", type=float, default=30.0,
+                        help="Seconds a draining worker gets to finish in-flight requests.")
+    parser.add_argument("--watch_reload", type=float, default=0,
+                        help="Poll the weights and mapping files every N seconds and hot-reload "
+                             "them when they change (0: only on SIGHUP or POST /admin/reload).")
+    parser.add_argument("--admin_token", default=os.environ.get("GENE_EXPLORER_ADMIN_TOKEN"),
+                        help="Token required in X-Admin-Token by /admin endpoints (default: "
+                             "$GENE_EXPLORER_ADMIN_TOKEN; unset disables them).")
     parser.add_argument("--vocab_size", type=int, default=2000)
     parser.add_argument("--embedding_dim", type=int, default=256)
     parser.add_argument("--num_heads", type=int, default=8)
@@ -493,51 +3531,119 @@ def main():
     parser.add_argument("--timepoint_classes", type=int, default=5)
     parser.add_argument("--stage_classes", type=int, default=10)
     parser.add_argument("--anatomy_classes", type=int, default=10)
-    args = parser.parse_args()
-    
+    return parser
+
+def init_state(args, timer):
+    """Set CONFIG, the caches, metrics, the gene mapping and CONTEXTS from parsed arguments."""
+    global CONTEXTS, RESPONSE_CACHE, EXPANSION_CACHE, ADMISSION, METRICS, GENE_LABELS, CONFIG
+
     # Store config
     CONFIG = vars(args)
+    if args.metrics != "off":
+        METRICS = Metrics(stage_timings=args.metrics == "full")
+    RESPONSE_CACHE, EXPANSION_CACHE = build_caches(args)
+    if args.admission_capacity > 0:
+        ADMISSION = AdmissionController(args.admission_capacity, max_queue=args.admission_queue,
+                                        timeout=args.admission_timeout)
     
     # Load gene mapping
     print(f"Loading gene mapping from {args.mapping_json}")
-    with open(args.mapping_json, "r") as f:
-        gene_map = json.load(f)
-    GENE2IDX.update(gene_map)
-    INDEX2GENE.update({str(v): k for k, v in gene_map.items()})
+    with timer.phase("load gene mapping"):
+        gene2idx, index2gene = load_gene_mapping(args.mapping_json)
+        GENE2IDX.update(gene2idx)
+        INDEX2GENE.update(index2gene)
     
+    with timer.phase("label table"):
+        GENE_LABELS = build_label_table(INDEX2GENE, args.vocab_size)
+
     # Verify initial gene
     if args.initial_gene not in GENE2IDX:
         print(f"Warning: initial_gene '{args.initial_gene}' not found in mapping.")
-    
-    # Initialize model
-    print("Initializing tsGPTv207WithAttention model...")
-    MODEL = tsGPTv207WithAttention(
-        vocab_size=args.vocab_size,
-        embed_dim=args.embedding_dim,
-        num_heads=args.num_heads,
-        ff_dim=args.ff_dim,
-        num_blocks=args.num_blocks,
-        dropout=args.dropout,
-        metadata_dim=args.metadata_dim,
-        timepoint_classes=args.timepoint_classes,
-        stage_classes=args.stage_classes,
-        anatomy_classes=args.anatomy_classes,
-    )
 
-    # Dummy forward pass to initialize weights
-    print("Performing a dummy forward pass to build the model graph...")
-    dummy_inputs = {
-        "gene_tokens": tf.zeros([1, SEQ_LEN], dtype=tf.int64),
-        "masked_expr": tf.zeros([1, SEQ_LEN], dtype=tf.float32),
-        "metadata_emb": tf.zeros([1, args.metadata_dim], dtype=tf.float32),
-    }
-    _ = MODEL(dummy_inputs, training=False)
+    # Precompute the embedding of every known context
+    with timer.phase("context table"):
+        CONTEXTS = ContextTable(dim=args.metadata_dim)
+    print(f"Precomputed {len(CONTEXTS)} context embeddings.")
+
+def main():
+    global NEIGHBOUR_INDEX
+
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    if args.engine == "numpy" and args.precision != "float32":
+        parser.error("--engine numpy only supports --precision float32")
+    for spec in args.model:
+        name, model_args = parse_model_spec(parser, args, spec)
+        MODEL_ARGS[name] = model_args
 
-    # Load weights
+    timer = StartupTimer()
+    init_state(args, timer)
+
+    # Load the weights once; pre-forked workers share these arrays
     print(f"Loading weights from {args.weights_file}")
-    MODEL.load_weights(args.weights_file)
-    print("Model weights loaded successfully.")
-    
+    with timer.phase("load weights"):
+        layer_weights, source = load_weights(args)
+    print(f"Weights read from {'the memory-mapped cache' if source == 'cache' else 'H5'}.")
+
+    if args.fidelity_report or args.parity_check:
+        modes = ["numpy"] if args.parity_check else args.fidelity_modes.split(",")
+        unknown = sorted(set(modes) - set(PRECISIONS) - {"numpy"})
+        if unknown:
+            parser.error(f"unknown --fidelity_modes {unknown}; "
+                         f"choose from {list(PRECISIONS) + ['numpy']}")
+        import tsgpt_model
+        tsgpt_model.configure_tf_threads(args.intra_op_threads, args.inter_op_threads)
+        report = fidelity_report(
+            args, layer_weights, modes,
+            num_genes=args.fidelity_genes, num_contexts=args.fidelity_contexts,
+        )
+        print_fidelity_report(report)
+        if args.fidelity_output:
+            with open(args.fidelity_output, "w") as f:
+                json.dump(report, f, indent=2)
+        if args.parity_check:
+            parity = report["modes"]["numpy"]
+            passed = parity["max_abs_diff"] <= args.parity_atol and parity["overlap_min"] == 1.0
+            print(f"NumPy engine parity {'PASSED' if passed else 'FAILED'} "
+                  f"(max |diff| {parity['max_abs_diff']:.2e}, tolerance {args.parity_atol:.0e}).")
+            sys.exit(0 if passed else 1)
+        return
+
+    if args.build_neighbour_index:
+        build_neighbour_index(args, layer_weights, args.neighbour_index or f"{args.weights_file}.neighbours",
+                              processes=args.index_processes or os.cpu_count() or 1,
+                              max_contexts=args.index_max_contexts)
+        return
+    NEIGHBOUR_INDEX = open_serving_index(args)
+
+    # Weights of the --model variants, loaded (and shared with workers) like the main model's
+    model_weights = {}
+    for name, model_args in MODEL_ARGS.items():
+        print(f"Loading weights of model '{name}' from {model_args.weights_file}")
+        with timer.phase(f"load weights ({name})"):
+            model_weights[name], _ = load_weights(model_args)
+
+    if args.workers > 0:
+        if args.intra_op_threads == 0:
+            args.intra_op_threads = max(1, (os.cpu_count() or 1) // args.workers)
+        if args.inter_op_threads == 0:
+            args.inter_op_threads = 1
+        # TensorFlow's thread pools are per process and shared by every model
+        for model_args in MODEL_ARGS.values():
+            model_args.intra_op_threads = args.intra_op_threads
+            model_args.inter_op_threads = args.inter_op_threads
+        timer.report()
+        serve_prefork(args, layer_weights, model_weights)
+        return
+
+    init_inference(args, layer_weights, timer, model_weights)
+
+    # Hot reload on SIGHUP, and on file changes with --watch_reload
+    signal.signal(signal.SIGHUP, lambda signum, frame: start_reload(reason="SIGHUP"))
+    if args.watch_reload > 0:
+        threading.Thread(target=watch_reload, args=(args.watch_reload,), daemon=True,
+                         name="reload-watcher").start()
+
     # Launch the Flask server
     print(f"Starting Flask server on port {args.port}...")
     app.run(host="0.0.0.0", port=args.port, debug=False)
@@ -0,0 +1,279 @@
+"""
+Benchmark suite for the gene network inference path.
+
+Builds tsGPTv207WithAttention with seeded random weights (no H5 file
+needed), brings up the same runtime app.py serves with, and times every
+max_depth x top_genes combination of the sweep:
+
+    end_to_end  POST /api/analyze through the Flask test client
+    analyze     analyze_gene_network called directly on the runner
+    visualize   prepare_network_for_visualization on that network
+
+plus process_attention_for_gene_network on synthetic full attention maps
+for every top_genes value. Each entry reports p50/p95/p99 latency, forward
+passes (model batches) and rows per call, and the peak RSS so far. Results
+are written as JSON; --compare prints the p50 change against an earlier run,
+e.g. one from another commit.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --depths 1,2 --top_genes 5,10 --repeats 3 -- --engine numpy
+    python benchmark.py --output new.json --compare old.json
+
+Arguments after "--" go to app.py's own options (engine, precision,
+batching, threads, ...). The response and expansion caches and the request
+deadline are off unless re-enabled there.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import numpy as np
+
+import app
+
+DEFAULT_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "combined_processed_207_gene2idx.json")
+
+class CountingRunner:
+    """Wraps a runner and counts forward passes (model batches) and rows."""
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.batches = 0
+        self.rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self.runner, name)
+
+    def center_attention(self, inputs):
+        self.batches += 1
+        self.rows += len(inputs["gene_tokens"])
+        return self.runner.center_attention(inputs)
+
+def random_layer_weights(args, seed):
+    """Seeded random weights of a freshly initialised tsGPTv207WithAttention."""
+    import tensorflow as tf
+    import tsgpt_model
+
+    tsgpt_model.configure_tf_threads(args.intra_op_threads, args.inter_op_threads)
+    tf.random.set_seed(seed)
+    model = tsgpt_model.tsGPTv207WithAttention(
+        vocab_size=args.vocab_size,
+        embed_dim=args.embedding_dim,
+        num_heads=args.num_heads,
+        ff_dim=args.ff_dim,
+        num_blocks=args.num_blocks,
+        dropout=args.dropout,
+        metadata_dim=args.metadata_dim,
+        timepoint_classes=args.timepoint_classes,
+        stage_classes=args.stage_classes,
+        anatomy_classes=args.anatomy_classes,
+    )
+    model.build_from_shapes(app.SEQ_LEN)
+    return [layer.get_weights() for layer in model.layers if layer.weights]
+
+def setup(app_argv, mapping_json, seed):
+    """Initialise app's global state with random weights; returns (args, counter)."""
+    args = app.build_arg_parser().parse_args(
+        ["--weights_file", "<random>", "--mapping_json", mapping_json,
+         "--response_cache_mb", "0", "--expansion_cache_size", "0", "--request_deadline", "0"] + app_argv
+    )
+    timer = app.StartupTimer("benchmark setup")
+    app.init_state(args, timer)
+    with timer.phase("random weights"):
+        layer_weights = random_layer_weights(args, seed)
+    app.init_inference(args, layer_weights, timer)
+
+    counter = CountingRunner(app.RUNNER)
+    app.RUNNER = counter
+    if app.SCHEDULER is not None:
+        app.SCHEDULER.runner = counter
+    return args, counter
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(fn, repeats, counter):
+    """
+    Call fn(i) for i in range(repeats) and summarise the latencies.
+    Returns (stats, last_result).
+    """
+    batches, rows = counter.batches, counter.rows
+    latencies = []
+    result = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = fn(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    stats = {
+        "repeats": repeats,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(np.mean(latencies)),
+        "forward_passes": (counter.batches - batches) / repeats,
+        "rows": (counter.rows - rows) / repeats,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    return stats, result
+
+def synthetic_attention(num_blocks, num_heads, rng):
+    """Row-softmaxed random attention maps shaped like one model call."""
+    maps = []
+    for _ in range(num_blocks):
+        logits = rng.standard_normal((1, num_heads, app.SEQ_LEN, app.SEQ_LEN)).astype(np.float32)
+        logits = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        maps.append(logits / logits.sum(axis=-1, keepdims=True))
+    return maps
+
+def run_benchmarks(args, counter, depths, top_genes_values, repeats, genes):
+    client = app.app.test_client()
+    context = (args.timepoint, args.dev_stage, args.anatomy)
+    results = []
+
+    def record(stage, stats, **params):
+        entry = {"stage": stage, **params, **stats}
+        results.append(entry)
+        shown = " ".join(f"{k}={v}" for k, v in params.items())
+        print(f"  {stage:<18}{shown:<26} p50 {stats['p50_ms']:9.1f} ms  p95 {stats['p95_ms']:9.1f} ms  "
+              f"p99 {stats['p99_ms']:9.1f} ms  {stats['forward_passes']:6.1f} passes  "
+              f"{stats['peak_rss_mb']:7.0f} MB")
+        sys.stdout.flush()
+
+    rng = np.random.default_rng(app.stable_seed("benchmark"))
+    attention = synthetic_attention(args.num_blocks, args.num_heads, rng)
+    gene_tokens = rng.integers(0, args.vocab_size, (1, app.SEQ_LEN))
+    for top_genes in top_genes_values:
+        stats, _ = measure(
+            lambda i: app.process_attention_for_gene_network(
+                attention, gene_tokens, app.SEQ_LEN // 2, top_n=top_genes),
+            repeats, counter,
+        )
+        record("process_attention", stats, top_genes=top_genes)
+
+    for max_depth in depths:
+        for top_genes in top_genes_values:
+            def end_to_end(i):
+                response = client.post("/api/analyze", json={
+                    "gene_name": genes[i % len(genes)], "max_depth": max_depth, "top_genes": top_genes,
+                    "timepoint": context[0], "dev_stage": context[1], "anatomy": context[2],
+                })
+                if response.status_code != 200:
+                    raise RuntimeError(f"/api/analyze returned {response.status_code}: {response.data[:200]}")
+                return response.data
+
+            def analyze(i):
+                return app.analyze_gene_network(
+                    counter, app.GENE2IDX[genes[i % len(genes)]], *context, args.vocab_size,
+                    max_depth=max_depth, top_genes_per_level=top_genes,
+                    max_batch_size=args.max_batch_size,
+                    deterministic=args.sampling == "deterministic",
+                )
+
+            params = {"max_depth": max_depth, "top_genes": top_genes}
+            stats, _ = measure(end_to_end, repeats, counter)
+            record("end_to_end", stats, **params)
+            stats, network = measure(analyze, repeats, counter)
+            stats["num_nodes"] = network.num_nodes
+            stats["num_edges"] = network.num_edges
+            record("analyze", stats, **params)
+            stats, _ = measure(lambda i: app.prepare_network_for_visualization(network), repeats, counter)
+            record("visualize", stats, **params)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Print the p50 change of every entry also present in a baseline run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(entry):
+        return (entry["stage"], entry.get("max_depth"), entry.get("top_genes"))
+
+    previous = {key(entry): entry for entry in baseline["results"]}
+    print(f"p50 vs {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for entry in results:
+        old = previous.get(key(entry))
+        if old is None:
+            continue
+        change = (entry["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0.0
+        stage, max_depth, top_genes = key(entry)
+        print(f"  {stage:<18}depth={max_depth or '-'} top={top_genes:<4} "
+              f"{old['p50_ms']:9.1f} -> {entry['p50_ms']:9.1f} ms  ({change:+.1f}%)")
+
+def main():
+    argv = sys.argv[1:]
+    app_argv = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, app_argv = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description="Gene network inference benchmarks")
+    parser.add_argument("--depths", default="1,2,3", help="Comma-separated max_depth values.")
+    parser.add_argument("--top_genes", default="5,10,25,50", help="Comma-separated top_genes values.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed calls per configuration.")
+    parser.add_argument("--genes", type=int, default=5,
+                        help="Centre genes sampled from the mapping; calls rotate through them.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random weights.")
+    parser.add_argument("--mapping_json", default=DEFAULT_MAPPING, help="JSON of gene->token ID.")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the results.")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against.")
+    bench_args = parser.parse_args(argv)
+
+    args, counter = setup(app_argv, bench_args.mapping_json, bench_args.seed)
+    rng = np.random.default_rng(bench_args.seed)
+    genes = sorted(app.GENE2IDX)
+    genes = [genes[i] for i in rng.choice(len(genes), size=min(bench_args.genes, len(genes)), replace=False)]
+
+    print(f"Benchmarking ({args.engine}, {args.precision}) over {genes}...")
+    results = run_benchmarks(
+        args, counter,
+        depths=[int(d) for d in bench_args.depths.split(",")],
+        top_genes_values=[int(t) for t in bench_args.top_genes.split(",")],
+        repeats=bench_args.repeats,
+        genes=genes,
+    )
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+            "engine": args.engine,
+            "precision": args.precision,
+            "sampling": args.sampling,
+            "max_batch_size": args.max_batch_size,
+            "batch_buckets": args.batch_buckets,
+            "batching_delay_ms": args.batching_delay_ms,
+            "seed": bench_args.seed,
+            "genes": genes,
+            "app_args": app_argv,
+        },
+        "results": results,
+    }
+    with open(bench_args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {bench_args.output}.")
+    if bench_args.compare:
+        compare(results, bench_args.compare)
+
+    if app.SCHEDULER is not None:
+        app.SCHEDULER.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+TensorFlow-free forward pass of tsGPTv207WithAttention for the attention
+network path.
+
+The network endpoints only need the head-averaged attention through the
+centre position of every block, so this engine computes exactly that with
+NumPy matrix products: embeddings, the attention and FFN of each block, and
+nothing after the last block's attention (its FFN, the final norm and the
+output heads cannot change any attention score). Weights come straight from
+read_h5_weights / load_layer_weights, and memory-mapped weights are used in
+place without copies.
+"""
+
+import numpy as np
+from runner_base import BaseInferenceRunner
+
+LAYER_NORM_EPSILON = 1e-6
+
+def _layer_norm(x, gamma, beta):
+    mean = x.mean(axis=-1, keepdims=True)
+    centered = x - mean
+    variance = np.square(centered).mean(axis=-1, keepdims=True)
+    return centered / np.sqrt(variance + LAYER_NORM_EPSILON) * gamma + beta
+
+def _softmax(x):
+    x = x - x.max(axis=-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=-1, keepdims=True)
+    return x
+
+# -------------------------------------------------------------------
+# Model
+# -------------------------------------------------------------------
+class NumpyTsGPT:
+    """
+    The parts of tsGPTv207WithAttention that feed the attention scores.
+
+    layer_weights is one list of arrays per weighted layer in H5 order:
+    gene_emb, expr_dense, metadata_transform, one entry per transformer
+    block, then final_norm and the four output heads. Dimensions (embedding
+    size, heads, blocks) are read off the weight shapes.
+    """
+
+    def __init__(self, layer_weights):
+        num_blocks = len(layer_weights) - 8
+        if num_blocks < 1 or any(len(w) != 16 for w in layer_weights[3:3 + num_blocks]):
+            raise ValueError("Weights do not have the tsGPTv207WithAttention layout.")
+        (gene_emb,), (expr_kernel, expr_bias), (meta_kernel, meta_bias) = layer_weights[:3]
+        self.gene_emb = gene_emb
+        self.expr_kernel = expr_kernel[0]
+        self.expr_bias = expr_bias
+        self.meta_kernel = meta_kernel
+        self.meta_bias = meta_bias
+        self.vocab_size, self.embed_dim = gene_emb.shape
+        self.metadata_dim = meta_kernel.shape[0]
+        _, self.num_heads, self.key_dim = layer_weights[3][0].shape
+        self.blocks = [self._block_weights(w) for w in layer_weights[3:3 + num_blocks]]
+
+    def _block_weights(self, weights):
+        (q_kernel, q_bias, k_kernel, k_bias, v_kernel, v_bias, out_kernel, out_bias,
+         ffn1_kernel, ffn1_bias, ffn2_kernel, ffn2_bias,
+         norm1_gamma, norm1_beta, norm2_gamma, norm2_beta) = weights
+        width = self.num_heads * self.key_dim
+        # Reshapes of contiguous (possibly memory-mapped) arrays are views
+        return {
+            "q": (q_kernel.reshape(self.embed_dim, width), q_bias.reshape(width)),
+            "k": (k_kernel.reshape(self.embed_dim, width), k_bias.reshape(width)),
+            "v": (v_kernel.reshape(self.embed_dim, width), v_bias.reshape(width)),
+            "out": (out_kernel.reshape(width, self.embed_dim), out_bias),
+            "ffn1": (ffn1_kernel, ffn1_bias),
+            "ffn2": (ffn2_kernel, ffn2_bias),
+            "norm1": (norm1_gamma, norm1_beta),
+            "norm2": (norm2_gamma, norm2_beta),
+        }
+
+    @property
+    def num_blocks(self):
+        return len(self.blocks)
+
+    def metadata_transform(self, embeddings):
+        """The metadata_transform Dense layer (with its relu)."""
+        return np.maximum(np.asarray(embeddings, dtype=np.float32) @ self.meta_kernel + self.meta_bias, 0)
+
+    def center_attention(self, gene_tokens, masked_expr, metadata_proj, center_pos):
+        """
+        (attn_from, attn_to) NumPy float32 arrays of shape
+        [num_blocks, batch, seq_len]: the head-averaged attention row and
+        column through center_pos in every block.
+        """
+        x = self.gene_emb[gene_tokens]
+        x = x + (masked_expr[..., None].astype(np.float32) * self.expr_kernel + self.expr_bias)
+        x = x + metadata_proj[:, None, :].astype(np.float32)
+
+        attn_from = []
+        attn_to = []
+        for i, block in enumerate(self.blocks):
+            last = i == len(self.blocks) - 1
+            x, attention = self._block(x, block, need_output=not last)
+            attn_from.append(attention[:, :, center_pos, :].mean(axis=1))
+            attn_to.append(attention[:, :, :, center_pos].mean(axis=1))
+        return np.stack(attn_from), np.stack(attn_to)
+
+    def _block(self, x, block, need_output=True):
+        batch_size, seq_len, _ = x.shape
+        flat = x.reshape(batch_size * seq_len, self.embed_dim)
+
+        def heads(name):
+            kernel, bias = block[name]
+            projected = (flat @ kernel + bias).reshape(batch_size, seq_len, self.num_heads, self.key_dim)
+            return projected.transpose(0, 2, 1, 3)  # [batch, heads, seq, key_dim]
+
+        # Keras scales the query before the dot product
+        query = heads("q") * np.float32(1.0 / np.sqrt(self.key_dim))
+        key = heads("k")
+        attention = _softmax(query @ key.transpose(0, 1, 3, 2))  # [batch, heads, seq, seq]
+        if not need_output:
+            return None, attention
+
+        context = (attention @ heads("v")).transpose(0, 2, 1, 3)
+        context = context.reshape(batch_size * seq_len, self.num_heads * self.key_dim)
+        kernel, bias = block["out"]
+        out1 = _layer_norm(flat + (context @ kernel + bias), *block["norm1"])
+
+        kernel, bias = block["ffn1"]
+        hidden = np.maximum(out1 @ kernel + bias, 0)
+        kernel, bias = block["ffn2"]
+        out2 = _layer_norm(out1 + (hidden @ kernel + bias), *block["norm2"])
+        return out2.reshape(batch_size, seq_len, self.embed_dim), attention
+
+# -------------------------------------------------------------------
+# Inference runner
+# -------------------------------------------------------------------
+class NumpyInferenceRunner(BaseInferenceRunner):
+    """
+    Drop-in for tsgpt_model.InferenceRunner backed by NumpyTsGPT. There is
+    nothing to trace, so batches run at their exact size; batch_buckets only
+    sets the largest batch handed to one call.
+    """
+
+    def _project(self, embeddings):
+        return self.model.metadata_transform(embeddings)
+
+    def _run(self, inputs):
+        attn_from = []
+        attn_to = []
+        for start in range(0, len(inputs["gene_tokens"]), self.max_batch_size):
+            chunk = {k: v[start:start + self.max_batch_size] for k, v in inputs.items()}
+            chunk_from, chunk_to = self.model.center_attention(
+                chunk["gene_tokens"], chunk["masked_expr"], chunk["metadata_proj"], self.center_pos
+            )
+            attn_from.append(chunk_from)
+            attn_to.append(chunk_to)
+        return np.concatenate(attn_from, axis=1), np.concatenate(attn_to, axis=1)
@@ -0,0 +1,97 @@
+"""
+Engine-independent half of the inference runners: batch buckets, the
+ContextTable projections and warmup, shared by tsgpt_model.InferenceRunner
+and numpy_engine.NumpyInferenceRunner so the two engines cannot drift
+apart. Importing it does not import TensorFlow.
+"""
+
+import time
+import threading
+import numpy as np
+
+class BaseInferenceRunner:
+    """
+    Centre-attention inference over [B, seq_len] batches.
+
+    Contexts arrive as ContextTable row indices; the runner keeps the
+    metadata_transform projection of every table row, so the per-request
+    metadata work is a single gather. Subclasses provide _project (the
+    projection of embedding rows, as a float32 NumPy array) and _run (a
+    batch of gene_tokens / masked_expr / metadata_proj arrays to
+    (attn_from, attn_to)).
+    """
+
+    def __init__(self, model, seq_len, batch_buckets=(1,)):
+        self.model = model
+        self.seq_len = seq_len
+        self.center_pos = seq_len // 2
+        self.batch_buckets = tuple(sorted(set(batch_buckets)))
+        self.contexts = None
+        self.context_projections = None
+        self._context_lock = threading.Lock()
+
+    @property
+    def max_batch_size(self):
+        return self.batch_buckets[-1]
+
+    def _project(self, embeddings):
+        raise NotImplementedError
+
+    def _run(self, inputs):
+        raise NotImplementedError
+
+    def attach_contexts(self, contexts):
+        """Project every row of a ContextTable through metadata_transform."""
+        with self._context_lock:
+            self.contexts = contexts
+            self.context_projections = self._project(contexts.embeddings)
+
+    def _projections_for(self, context_idx):
+        projections = self.context_projections
+        if int(np.max(context_idx)) >= len(projections):
+            # Rows appended lazily to the table since the last projection
+            with self._context_lock:
+                projections = self.context_projections
+                new_rows = self.contexts.embeddings[len(projections):]
+                if len(new_rows):
+                    projections = np.concatenate([projections, self._project(new_rows)])
+                    self.context_projections = projections
+        return projections[context_idx]
+
+    def center_attention(self, inputs):
+        """
+        Run a batch of NumPy inputs (see create_batch_input_data) and return
+        (attn_from, attn_to) NumPy arrays of shape [num_blocks, batch, seq_len].
+        """
+        return self._run({
+            "gene_tokens": inputs["gene_tokens"],
+            "masked_expr": inputs["masked_expr"],
+            "metadata_proj": self._projections_for(inputs["context_idx"]),
+        })
+
+    def _zero_inputs(self, batch_size):
+        return {
+            "gene_tokens": np.zeros([batch_size, self.seq_len], dtype=np.int64),
+            "masked_expr": np.zeros([batch_size, self.seq_len], dtype=np.float32),
+            "metadata_proj": np.zeros([batch_size, self.model.embed_dim], dtype=np.float32),
+        }
+
+    def warmup(self, repeats=3):
+        """
+        Run every bucket once (tracing it, or faulting in memory-mapped
+        weights), then time `repeats` more calls. Returns a list of
+        (bucket, first_call_seconds, steady_state_seconds) tuples.
+        """
+        timings = []
+        for bucket in self.batch_buckets:
+            inputs = self._zero_inputs(bucket)
+            start = time.perf_counter()
+            self._run(inputs)
+            first_call = time.perf_counter() - start
+            steady = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                self._run(inputs)
+                steady.append(time.perf_counter() - start)
+            timings.append((bucket, first_call, float(np.median(steady)) if steady else first_call))
+        return timings
@@ -0,0 +1,210 @@
+"""
+Tests for the gene network API. Run with: python -m pytest test_app.py
+"""
+
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+import app
+
+class GraphIndex:
+    """
+    Stands in for the NeighbourIndex over a seeded random graph, so networks
+    are expanded without a model (the runner is never called).
+    """
+
+    def __init__(self, num_genes=300, top_n=13, seed=0):
+        rng = random.Random(seed)
+        self.relationships = {
+            gene_id: {related_id: rng.random()
+                      for related_id in rng.sample(range(num_genes), top_n)}
+            for gene_id in range(num_genes)
+        }
+
+    def get(self, gene_id, timepoint, dev_stage, anatomy, top_n):
+        return self.relationships[gene_id]
+
+def network_contents(network):
+    nodes = dict(zip(network.node_ids, network.node_depths))
+    edges = {}
+    for source, target, score, depth in zip(network.edge_sources, network.edge_targets,
+                                            network.edge_scores, network.edge_depths):
+        key = (source, target) if source <= target else (target, source)
+        edges[key] = (source, score, depth)
+    return nodes, edges
+
+def baseline_bfs(relationships, gene_id, max_depth):
+    """The original node-by-node BFS of analyze_gene_network: first edge found wins."""
+    nodes = {gene_id: 0}
+    edges = {}
+    queue = deque([gene_id])
+    while queue:
+        current_id = queue.popleft()
+        depth = nodes[current_id]
+        if depth == max_depth:
+            continue
+        for related_id, score in relationships[current_id].items():
+            if related_id == current_id:
+                continue
+            if related_id not in nodes:
+                nodes[related_id] = depth + 1
+                queue.append(related_id)
+            key = (current_id, related_id) if current_id <= related_id else (related_id, current_id)
+            edges.setdefault(key, (current_id, float(score), depth + 1))
+    return nodes, edges
+
+def analyze(index, gene_id, max_depth, max_batch_size=None, beam=None):
+    return app.analyze_gene_network(
+        None, gene_id, "adult", "adult", "whole organism", vocab_size=300,
+        max_depth=max_depth, top_genes_per_level=13, max_batch_size=max_batch_size,
+        neighbour_index=index, beam=beam
+    )
+
+@pytest.mark.parametrize("max_depth", [1, 2, 3])
+@pytest.mark.parametrize("max_batch_size", [None, 1, 64])
+def test_bfs_matches_baseline(max_depth, max_batch_size):
+    index = GraphIndex()
+    for gene_id in range(50):
+        network = analyze(index, gene_id, max_depth, max_batch_size)
+        assert network_contents(network) == baseline_bfs(index.relationships, gene_id, max_depth)
+
+@pytest.mark.parametrize("max_depth", [1, 2, 3, 4])
+@pytest.mark.parametrize("gene_id", [0, 7, 42, 199])
+@pytest.mark.parametrize("max_batch_size", [None, 1, 64])
+def test_unconstrained_beam_matches_bfs(gene_id, max_depth, max_batch_size):
+    index = GraphIndex()
+    bfs = analyze(index, gene_id, max_depth, max_batch_size)
+    beam = analyze(index, gene_id, max_depth, max_batch_size, beam={})
+    bfs_nodes, bfs_edges = network_contents(bfs)
+    beam_nodes, beam_edges = network_contents(beam)
+    assert beam_nodes == bfs_nodes
+    assert beam_edges.keys() == bfs_edges.keys()
+    for key, (source, score, depth) in beam_edges.items():
+        bfs_source, bfs_score, bfs_depth = bfs_edges[key]
+        assert depth == bfs_depth
+        if bfs_nodes[key[0]] != bfs_nodes[key[1]]:
+            assert (source, score) == (bfs_source, bfs_score)
+        else:
+            # Same-depth edges keep the higher score in beam mode, the first found in BFS
+            assert score >= bfs_score
+    assert beam.summary["expansions"] == bfs.summary["expansions"]
+    assert beam.summary["pruned_nodes"] == 0
+
+def test_replaced_edges_are_recorded_for_streaming():
+    network = app.NetworkBuilder(1, 3)
+    network.add_relationships(1, 0, {2: 0.5})
+    network.add_relationships(2, 1, {3: 0.4})
+    network.add_relationships(3, 2, {2: 0.9}, replace=True)
+    assert not network.updated_edges
+    network.add_relationships(1, 0, {3: 0.7}, replace=True)
+    network.add_relationships(3, 1, {2: 0.9}, replace=True)
+    assert network.updated_edges == {1}
+    assert (network.edge_sources[1], network.edge_scores[1]) == (3, 0.9)
+
+def test_admission_runs_requests_above_capacity_alone():
+    admission = app.AdmissionController(100, timeout=0.05)
+    assert admission.acquire(60)
+    assert not admission.acquire(150)
+    admission.release(60)
+    assert admission.acquire(150)
+    assert admission.stats()["in_flight"] == 100
+    assert not admission.acquire(1)
+    admission.release(150)
+    assert admission.acquire(100)
+    assert admission.stats()["rejected"] == 2
+
+def test_panel_cost_counts_unique_expansions():
+    def params(gene, context=("adult", "adult", "whole organism")):
+        return {"timepoint": context[0], "dev_stage": context[1], "anatomy": context[2],
+                "max_depth": 3, "top_genes": 13, "ensemble": 2}
+    panel = [params(gene) for gene in range(12)]
+    assert app.estimate_panel_cost(panel, vocab_size=2000) == 2000 * 2
+    assert app.estimate_panel_cost(panel[:2], vocab_size=2000) == 2 * 183 * 2
+    other = params(0, ("larva", "larva", "head"))
+    assert app.estimate_panel_cost(panel + [other], vocab_size=2000) == (2000 + 183) * 2
+
+def test_admin_reload_needs_a_token_and_configured_directories(monkeypatch, tmp_path):
+    weights = tmp_path / "weights" / "model.h5"
+    monkeypatch.setattr(app, "CONFIG", {"weights_file": str(weights),
+                                        "mapping_json": str(tmp_path / "mapping.json")})
+    client = app.app.test_client()
+    assert client.post("/admin/reload", environ_base={"REMOTE_ADDR": "127.0.0.1"}).status_code == 403
+
+    app.CONFIG["admin_token"] = "secret"
+    headers = {"X-Admin-Token": "secret"}
+    for body in ({"weights_file": "/etc/passwd"},
+                 {"weights_file": str(weights.parent / ".." / ".." / "model.h5")},
+                 {"mapping_json": "/tmp/elsewhere/mapping.json"}):
+        assert client.post("/admin/reload", json=body, headers=headers).status_code == 403
+    assert client.post("/admin/reload", json={"weights_file": str(weights.parent / "missing.h5")},
+                       headers=headers).status_code == 400
+
+def test_model_spec_takes_list_options():
+    parser = app.build_arg_parser()
+    args = parser.parse_args(["--weights_file", "main.h5", "--mapping_json", "mapping.json"])
+    name, model_args = app.parse_model_spec(
+        parser, args, "perturb=perturb.h5,num_blocks=6,batch_buckets=1+2+4,eager")
+    assert name == "perturb"
+    assert model_args.weights_file == "perturb.h5"
+    assert model_args.num_blocks == 6
+    assert model_args.batch_buckets == "1,2,4"
+    assert model_args.eager
+    assert args.batch_buckets != "1,2,4"
+
+def test_analyze_batch_rejects_beam(monkeypatch):
+    monkeypatch.setattr(app, "CONFIG", {})
+    monkeypatch.setattr(app, "hosted_model", lambda name=None: object())
+    client = app.app.test_client()
+    response = client.post("/api/analyze_batch", json={"genes": ["a", "b"], "beam": True})
+    assert response.status_code == 400
+
+def test_full_context_table_turns_new_contexts_away(monkeypatch):
+    monkeypatch.setattr(app, "CONTEXTS", app.ContextTable(max_extra=1))
+    known = app.known_contexts()[0]
+    assert app.reserve_contexts([known, ("day 1", "unknown", "tail")]) is None
+    assert "full" in app.reserve_contexts([("day 2", "unknown", "tail")])
+    assert app.reserve_contexts([known, ("day 1", "unknown", "tail")]) is None
+    monkeypatch.setattr(app, "CONFIG", {})
+    assert app.parse_contexts([["day 3", "unknown", "tail"]])[1] is not None
+
+@pytest.mark.parametrize("beam", [{"min_edge_score": "abc"}, {"min_path_score": None},
+                                  {"max_expanded": "ten"}, {"max_expanded": -3}])
+def test_invalid_beam_controls_get_400(monkeypatch, beam):
+    monkeypatch.setattr(app, "CONFIG", {})
+    with app.app.test_request_context("/"):
+        params, error, status = app.parse_network_request({"gene_name": "a", "beam": beam})
+    assert params is None and status == 400
+
+@pytest.mark.parametrize("ensemble", ["abc", None, [4]])
+def test_invalid_ensemble_gets_400(monkeypatch, ensemble):
+    monkeypatch.setattr(app, "CONFIG", {})
+    with app.app.test_request_context("/"):
+        params, error, status = app.parse_network_request({"gene_name": "a", "ensemble": ensemble})
+    assert params is None and status == 400
+
+def test_numpy_engine_matches_tensorflow(monkeypatch):
+    pytest.importorskip("tensorflow")
+    import benchmark
+
+    args = app.build_arg_parser().parse_args([
+        "--weights_file", "<random>", "--mapping_json", "mapping.json",
+        "--vocab_size", "300", "--embedding_dim", "32", "--num_heads", "2", "--ff_dim", "64",
+        "--num_blocks", "2", "--batch_buckets", "1,4,8",
+    ])
+    monkeypatch.setattr(app, "CONTEXTS", app.ContextTable(dim=args.metadata_dim))
+    layer_weights = benchmark.random_layer_weights(args, seed=0)
+    _, tf_runner = app.build_runner(args, layer_weights)
+    _, numpy_runner = app.build_numpy_runner(args, layer_weights)
+
+    contexts = app.known_contexts()[::97]
+    gene_ids = list(range(0, 300, 23))
+    inputs, _ = app.create_context_batch_input_data(
+        gene_ids, [contexts[i % len(contexts)] for i in range(len(gene_ids))],
+        vocab_size=args.vocab_size, deterministic=True
+    )
+    for expected, actual in zip(tf_runner.center_attention(inputs),
+                                numpy_runner.center_attention(inputs)):
+        np.testing.assert_allclose(actual, expected, atol=1e-5)
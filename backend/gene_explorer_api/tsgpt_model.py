@@ -0,0 +1,361 @@
+"""
+TensorFlow side of the gene network backend: the tsGPTv207WithAttention
+architecture and its compiled inference runner.
+
+app.py imports this module lazily, so processes that never run the model
+(the pre-fork supervisor, tooling that only reads weights) do not pay for
+importing TensorFlow.
+"""
+
+import numpy as np
+import tensorflow as tf
+from contextlib import contextmanager
+from runner_base import BaseInferenceRunner
+
+PRECISIONS = ("float32", "bfloat16", "float16", "int8")
+
+# -------------------------------------------------------------------
+# Model architecture
+# -------------------------------------------------------------------
+class TransformerBlockWithAttention(tf.keras.layers.Layer):
+    def __init__(self, embed_dim, num_heads, ff_dim, dropout=0.1):
+        super().__init__()
+        self.att = tf.keras.layers.MultiHeadAttention(num_heads=num_heads, key_dim=embed_dim)
+        self.ffn = tf.keras.Sequential([
+            tf.keras.layers.Dense(ff_dim, activation="relu"),
+            tf.keras.layers.Dense(embed_dim),
+        ])
+        self.norm1 = tf.keras.layers.LayerNormalization(epsilon=1e-6)
+        self.norm2 = tf.keras.layers.LayerNormalization(epsilon=1e-6)
+        self.dropout1 = tf.keras.layers.Dropout(dropout)
+        self.dropout2 = tf.keras.layers.Dropout(dropout)
+    
+    def build_from_shapes(self, seq_len, embed_dim):
+        """Create the block's variables from its input shape, without a forward pass."""
+        shape = tf.TensorShape([None, seq_len, embed_dim])
+        self.att._build_from_signature(query=shape, value=shape)
+        # The projections are only created above; build them in call order
+        for dense in (self.att._query_dense, self.att._key_dense, self.att._value_dense):
+            dense.build(shape)
+        self.att._output_dense.build(
+            tf.TensorShape([None, seq_len, self.att._num_heads, self.att._key_dim])
+        )
+        self.ffn.build(shape)
+        self.norm1.build(shape)
+        self.norm2.build(shape)
+        self.built = True
+
+    def call(self, x, training=False, return_attention=False, center_pos=None):
+        """
+        With return_attention=True, also returns the [batch, heads, seq, seq]
+        attention scores, or, when center_pos is given, only the (from, to)
+        pair of [batch, seq] head-averaged slices through that position, so
+        the full score tensor never outlives this block.
+        """
+        if return_attention:
+            attn_out, attn_weights = self.att(x, x, x, return_attention_scores=True)
+            if center_pos is not None:
+                attn_weights = (
+                    tf.reduce_mean(attn_weights[:, :, center_pos, :], axis=1),
+                    tf.reduce_mean(attn_weights[:, :, :, center_pos], axis=1),
+                )
+        else:
+            attn_out = self.att(x, x, x)
+        attn_out = self.dropout1(attn_out, training=training)
+        out1 = self.norm1(x + attn_out)
+        ffn_out = self.ffn(out1)
+        ffn_out = self.dropout2(ffn_out, training=training)
+        out2 = self.norm2(out1 + ffn_out)
+        if return_attention:
+            return out2, attn_weights
+        return out2
+
+class tsGPTv207WithAttention(tf.keras.Model):
+    def __init__(
+        self,
+        vocab_size,
+        embed_dim=256,
+        num_heads=8,
+        ff_dim=768,
+        num_blocks=4,
+        dropout=0.1,
+        metadata_dim=64,
+        timepoint_classes=5,
+        stage_classes=10,
+        anatomy_classes=10,
+    ):
+        super().__init__()
+        self.vocab_size = vocab_size
+        self.embed_dim = embed_dim
+        self.metadata_dim = metadata_dim
+
+        self.gene_emb = tf.keras.layers.Embedding(vocab_size, embed_dim)
+        self.expr_dense = tf.keras.layers.Dense(embed_dim)
+        self.metadata_transform = tf.keras.layers.Dense(embed_dim, activation="relu")
+
+        self.blocks = [
+            TransformerBlockWithAttention(embed_dim, num_heads, ff_dim, dropout)
+            for _ in range(num_blocks)
+        ]
+        self.final_norm = tf.keras.layers.LayerNormalization(epsilon=1e-6)
+        self.dropout = tf.keras.layers.Dropout(dropout)
+
+        # Output heads
+        self.expr_head = tf.keras.layers.Dense(1)
+        self.tp_head = tf.keras.Sequential([
+            tf.keras.layers.Dense(embed_dim, activation="relu"),
+            tf.keras.layers.Dense(timepoint_classes, activation="softmax"),
+        ])
+        self.stage_head = tf.keras.Sequential([
+            tf.keras.layers.Dense(embed_dim, activation="relu"),
+            tf.keras.layers.Dense(stage_classes, activation="softmax"),
+        ])
+        self.anat_head = tf.keras.Sequential([
+            tf.keras.layers.Dense(embed_dim, activation="relu"),
+            tf.keras.layers.Dense(anatomy_classes, activation="softmax"),
+        ])
+    
+    def call(self, inputs, training=False, return_attention=False, center_pos=None):
+        gene_tokens = inputs["gene_tokens"]
+        masked_expr = inputs["masked_expr"]
+
+        # Embed gene tokens and expression
+        g = self.gene_emb(gene_tokens)
+        e = self.expr_dense(tf.expand_dims(masked_expr, axis=-1))
+        x = g + e
+
+        # Embed metadata, unless the caller passes precomputed
+        # metadata_transform outputs (see ContextTable)
+        if "metadata_proj" in inputs:
+            m = inputs["metadata_proj"]
+        else:
+            m = self.metadata_transform(inputs["metadata_emb"])
+        m = tf.expand_dims(m, axis=1)
+        x = x + m
+        
+        attention_weights = []
+        for block in self.blocks:
+            if return_attention:
+                x, attn = block(x, training=training, return_attention=True,
+                                center_pos=center_pos)
+                attention_weights.append(attn)
+            else:
+                x = block(x, training=training)
+        
+        x = self.final_norm(x)
+        x = self.dropout(x, training=training)
+        
+        # Expression logits across the tokens
+        expr_logits = self.expr_head(x)
+        expr_logits = tf.squeeze(expr_logits, axis=-1)
+        
+        # Classification heads (timepoint, stage, anatomy) use the "cls" token (x[:, 0, :])
+        cls_token = x[:, 0, :]
+        tp_out = self.tp_head(cls_token)
+        stage_out = self.stage_head(cls_token)
+        anat_out = self.anat_head(cls_token)
+        
+        outputs = {
+            "expr_recon": expr_logits,
+            "timepoint_head": tp_out,
+            "stage_head": stage_out,
+            "anatomy_head": anat_out,
+        }
+        if return_attention:
+            return outputs, attention_weights
+        return outputs
+    
+    def build_from_shapes(self, seq_len):
+        """
+        Create every variable from the known input shapes instead of running
+        a dummy forward pass.
+        """
+        self.gene_emb.build((None, seq_len))
+        self.expr_dense.build((None, seq_len, 1))
+        self.metadata_transform.build((None, self.metadata_dim))
+        for block in self.blocks:
+            block.build_from_shapes(seq_len, self.embed_dim)
+        self.final_norm.build((None, seq_len, self.embed_dim))
+        self.expr_head.build((None, seq_len, self.embed_dim))
+        for head in (self.tp_head, self.stage_head, self.anat_head):
+            head.build((None, self.embed_dim))
+        self.built = True
+
+    def predict_with_attention(self, inputs):
+        return self.call(inputs, training=False, return_attention=True)
+
+    def predict_center_attention(self, inputs, center_pos):
+        """
+        Inference returning only the attention through center_pos: outputs
+        plus (attn_from, attn_to), each [num_blocks, batch, seq_len] and
+        averaged over heads.
+        """
+        # Go through __call__ so Keras can build the model on a first call
+        outputs, attention = self(
+            inputs, training=False, return_attention=True, center_pos=center_pos
+        )
+        # Reduced-precision models still hand back float32 scores
+        attn_from = tf.cast(tf.stack([a[0] for a in attention]), tf.float32)
+        attn_to = tf.cast(tf.stack([a[1] for a in attention]), tf.float32)
+        return outputs, (attn_from, attn_to)
+
+# -------------------------------------------------------------------
+# Compiled inference
+# -------------------------------------------------------------------
+class InferenceRunner(BaseInferenceRunner):
+    """
+    Graph-mode entry point for centre-attention inference.
+
+    Every batch-size bucket gets its own tf.function with a fixed
+    input_signature, so a request is padded up to the next bucket and never
+    triggers a retrace. Batches larger than the biggest bucket are split.
+    With compiled=False the model is called eagerly on the exact batch.
+    Context projections and warmup come from BaseInferenceRunner.
+    """
+
+    def __init__(self, model, seq_len, batch_buckets=(1,), jit_compile=False, compiled=True):
+        super().__init__(model, seq_len, batch_buckets)
+        self.jit_compile = jit_compile
+        self.compiled = compiled
+        self._functions = {}
+        if compiled:
+            for batch_size in self.batch_buckets:
+                self._functions[batch_size] = self._compile(batch_size)
+
+    def _compile(self, batch_size):
+        model = self.model
+        center_pos = self.center_pos
+        seq_len = self.seq_len
+        signature = [
+            tf.TensorSpec([batch_size, seq_len], tf.int64, name="gene_tokens"),
+            tf.TensorSpec([batch_size, seq_len], tf.float32, name="masked_expr"),
+            tf.TensorSpec([batch_size, model.embed_dim], tf.float32, name="metadata_proj"),
+        ]
+
+        @tf.function(input_signature=signature, jit_compile=self.jit_compile)
+        def center_attention(gene_tokens, masked_expr, metadata_proj):
+            inputs = {
+                "gene_tokens": gene_tokens,
+                "masked_expr": masked_expr,
+                "metadata_proj": metadata_proj,
+            }
+            _, attention = model.predict_center_attention(inputs, center_pos)
+            return attention
+
+        return center_attention
+
+    def _bucket_for(self, batch_size):
+        for bucket in self.batch_buckets:
+            if bucket >= batch_size:
+                return bucket
+        return self.max_batch_size
+
+    def _project(self, embeddings):
+        return tf.cast(self.model.metadata_transform(embeddings), tf.float32).numpy()
+
+    def _run(self, inputs):
+        batch_size = len(inputs["gene_tokens"])
+        if not self.compiled:
+            _, (attn_from, attn_to) = self.model.predict_center_attention(inputs, self.center_pos)
+            return attn_from.numpy(), attn_to.numpy()
+
+        attn_from = []
+        attn_to = []
+        for start in range(0, batch_size, self.max_batch_size):
+            chunk = {k: v[start:start + self.max_batch_size] for k, v in inputs.items()}
+            rows = len(chunk["gene_tokens"])
+            bucket = self._bucket_for(rows)
+            if rows < bucket:
+                # Pad with copies of the first row; the extra rows are dropped below
+                pad = np.zeros(bucket - rows, dtype=np.int64)
+                chunk = {k: np.concatenate([v, v[pad]]) for k, v in chunk.items()}
+            chunk_from, chunk_to = self._functions[bucket](
+                chunk["gene_tokens"], chunk["masked_expr"], chunk["metadata_proj"]
+            )
+            attn_from.append(chunk_from.numpy()[:, :rows])
+            attn_to.append(chunk_to.numpy()[:, :rows])
+        return np.concatenate(attn_from, axis=1), np.concatenate(attn_to, axis=1)
+
+# -------------------------------------------------------------------
+# Runtime helpers
+# -------------------------------------------------------------------
+def assign_layer_weights(model, layer_weights):
+    """Assign read_h5_weights output to a built model, layer by layer."""
+    layers = [layer for layer in model.layers if layer.weights]
+    if len(layers) != len(layer_weights):
+        raise ValueError(f"Weights file has {len(layer_weights)} weighted layers, "
+                         f"the model has {len(layers)}.")
+    for layer, values in zip(layers, layer_weights):
+        layer.set_weights(values)
+
+def configure_tf_threads(intra_op_threads, inter_op_threads):
+    """Bound TensorFlow's thread pools; must run before the first TF op."""
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+# -------------------------------------------------------------------
+# Precision modes
+# -------------------------------------------------------------------
+@contextmanager
+def precision_policy(precision):
+    """
+    Keras dtype policy to construct a model under. bfloat16 and float16 use
+    the mixed policies: variables stay float32 (so the same weights load
+    unchanged) while the layers compute in the reduced type.
+    """
+    policy = {"bfloat16": "mixed_bfloat16", "float16": "mixed_float16"}.get(precision)
+    if policy is None:
+        yield
+        return
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy(policy)
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+
+class DynamicInt8Dense(tf.keras.layers.Layer):
+    """
+    Inference-only replacement for a built Dense layer with dynamic int8
+    quantization: the kernel is stored as int8 with one scale per output
+    unit, and each input row is quantized to int8 at call time with its own
+    scale. The integer product is accumulated in float32, which is exact
+    for int8 operands as long as the reduction dimension stays below 1040.
+    """
+
+    def __init__(self, dense, **kwargs):
+        super().__init__(name=f"{dense.name}_int8", **kwargs)
+        kernel = dense.kernel.numpy()
+        scale = np.maximum(np.abs(kernel).max(axis=0), 1e-12) / 127
+        self.kernel_q = tf.constant(np.round(kernel / scale).astype(np.int8))
+        self.kernel_scale = tf.constant(scale.astype(np.float32))
+        self.bias = tf.constant(dense.bias.numpy()) if dense.use_bias else None
+        self.activation = dense.activation
+
+    def call(self, x):
+        x = tf.cast(x, tf.float32)
+        x_scale = tf.maximum(tf.reduce_max(tf.abs(x), axis=-1, keepdims=True), 1e-12) / 127
+        x_q = tf.round(x / x_scale)
+        y = tf.einsum("...i,io->...o", x_q, tf.cast(self.kernel_q, tf.float32))
+        y = y * x_scale * self.kernel_scale
+        if self.bias is not None:
+            y = y + self.bias
+        return self.activation(y)
+
+def quantize_dense_layers(model):
+    """
+    Swap the Dense layers of every block's FFN and of the output heads for
+    DynamicInt8Dense. Call after the weights are assigned; attention
+    projections, embeddings and norms stay float32.
+    """
+    def quantized(layer):
+        if isinstance(layer, tf.keras.Sequential):
+            return tf.keras.Sequential([quantized(sub) for sub in layer.layers])
+        return DynamicInt8Dense(layer)
+
+    for block in model.blocks:
+        block.ffn = quantized(block.ffn)
+    for name in ("expr_head", "tp_head", "stage_head", "anat_head"):
+        setattr(model, name, quantized(getattr(model, name)))